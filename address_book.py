@@ -0,0 +1,30 @@
+"""For looking up peers by public key and public keys by peer id"""
+
+
+class AddressBook:
+    """For looking up peers by public key and public keys by peer id"""
+
+    def __init__(self, peers):
+        self.ids = {}           # Mapping of public_key to peer id
+        self.public_keys = {}   # Mapping of peer id to public_key
+        for id, data in peers.items():
+            self.add_peer(id, data["public_key"])
+
+    def add_peer(self, id, public_key):
+        """Registers a peer's id and public key"""
+        self.ids[public_key] = id
+        self.public_keys[id] = public_key
+
+    def id_of(self, public_key):
+        """Returns the id of the peer owning the public key (None if unknown)"""
+        return self.ids.get(public_key)
+
+    def public_key_of(self, id):
+        """Returns the public key of a peer (None if unknown)"""
+        return self.public_keys.get(id)
+
+    def __contains__(self, public_key):
+        return public_key in self.ids
+
+    def __len__(self):
+        return len(self.ids)
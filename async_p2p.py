@@ -0,0 +1,256 @@
+"""An asyncio engine for P2P - every connection is a coroutine on one event loop instead of a thread"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from config import SLOW_PEER_POLICY
+from framing import HEADER, check_length, encode_frame
+from outbound import Outbound, MAX_FRAMES, MAX_BYTES, WRITE_SIZE
+from p2p import P2P, BACKOFF_START, BACKOFF_MAX, DIAL_TIMEOUT
+
+DECODE_INLINE = 64 * 1024  # Larger frames (blocks, chains) are decoded on a thread, not on the event loop
+
+
+class AsyncPeerSender:
+    """The outbound queue of one peer, written to its stream by a task of the event loop"""
+
+    def __init__(self, peer_id, writer, loop, policy, max_frames=MAX_FRAMES, max_bytes=MAX_BYTES, codec=None):
+        self.peer_id = peer_id
+        self.writer = writer
+        self.loop = loop
+        self.policy = policy
+        self.codec = codec  # Compression agreed on with the peer (None: frames are sent as they are)
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()  # Frames are queued from any thread
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.waiting = False  # The writer task waits for frames
+        self.wakeup = asyncio.Event()
+        self.idle = threading.Event()  # Set while nothing is queued or being written
+        self.idle.set()
+        self.closed = False
+        self.disconnected = False  # Nothing more is sent to the peer (it fell too far behind)
+        self.sent = 0
+        self.sent_bytes = 0
+        self.writes = 0  # Socket writes (frames are joined into as few as possible)
+        self.dropped = 0
+        self.max_backlog = 0
+        asyncio.run_coroutine_threadsafe(self.write(), loop)
+
+    def put(self, frame):
+        """Queues a frame - never blocks. Returns False if it was dropped."""
+        with self.lock:
+            if self.closed or self.disconnected:
+                self.dropped += 1
+                return False
+            if len(self.queue) >= self.max_frames or self.queued_bytes + len(frame) > self.max_bytes:
+                self.dropped += 1
+                full = True
+            else:
+                full = False
+                self.queue.append(frame)
+                self.queued_bytes += len(frame)
+                self.max_backlog = max(self.max_backlog, len(self.queue))
+                self.idle.clear()
+                wake = self.waiting
+                self.waiting = False
+        if full:
+            if self.policy == "disconnect":
+                print(f"Disconnecting from slow peer {self.peer_id} ({len(self.queue)} frames queued)")
+                self.disconnect()
+            return False
+        if wake:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+        return True
+
+    async def write(self):
+        """Writer task - sends the queued frames in order, joining small ones into one write"""
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                if self.closed:
+                    return
+                if not self.queue:
+                    self.waiting = True
+                    self.idle.set()
+                    frames = None
+                else:
+                    frames = [self.queue.popleft()]
+                    size = len(frames[0])
+                    while self.queue and size + len(self.queue[0]) <= WRITE_SIZE:
+                        frames.append(self.queue.popleft())
+                        size += len(frames[-1])
+                    self.queued_bytes -= size
+            if frames is None:
+                await self.wakeup.wait()
+                continue
+            try:
+                self.writer.write(b"".join(frames) if len(frames) > 1 else frames[0])
+                await self.writer.drain()
+            except (ConnectionError, OSError) as e:
+                print(f"Error sending to peer {self.peer_id}: {e}")
+                with self.lock:
+                    self.dropped += len(frames)
+                self.close()
+                return
+            with self.lock:
+                self.sent += len(frames)
+                self.sent_bytes += size
+                self.writes += 1
+
+    def flush(self, timeout=None):
+        """Waits until everything queued was written - returns False on timeout"""
+        return self.idle.wait(timeout) or self.closed
+
+    def disconnect(self):
+        """Stops sending to the peer, leaving the stream open (see PeerSender.disconnect)"""
+        with self.lock:
+            self.disconnected = True
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.queued_bytes = 0
+            if not self.waiting:
+                return  # The writer task sets idle once its current write is done
+        self.idle.set()
+
+    def close(self):
+        """Stops the writer task and closes the stream (frames still queued are dropped)"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.queued_bytes = 0
+            self.idle.set()
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": len(self.queue),
+                "queued_bytes": self.queued_bytes,
+                "max_backlog": self.max_backlog,
+                "sent": self.sent,
+                "sent_bytes": self.sent_bytes,
+                "writes": self.writes,
+                "dropped": self.dropped,
+                "connected": not (self.closed or self.disconnected),
+            }
+
+
+class AsyncOutbound(Outbound):
+    """Outbound queues written by tasks of an event loop (same interface and limits as Outbound)"""
+
+    def __init__(self, loop, policy="drop", max_frames=MAX_FRAMES, max_bytes=MAX_BYTES, compression=None):
+        super().__init__(policy, max_frames, max_bytes, compression)
+        self.loop = loop
+
+    def add(self, peer_id, writer, codec=None):
+        self.senders[peer_id] = AsyncPeerSender(
+            peer_id, writer, self.loop, self.policy, self.max_frames, self.max_bytes, codec
+        )
+
+
+class AsyncP2P(P2P):
+    """
+    Same protocol, bootstrap and wallet interface as P2P, but listening, framing, dialling and sending all
+    run on one asyncio event loop (in its own thread) instead of a thread per connection and per peer.
+    Wallet work still runs on the dispatcher's worker threads and signatures on the verifier's processes,
+    and large frames are decoded on the loop's thread pool, so the loop itself only moves bytes.
+    """
+
+    def __init__(self, ip, port, wallet):
+        super().__init__(ip, port, wallet)
+        self.loop = asyncio.new_event_loop()
+        t = threading.Thread(target=self.loop.run_forever)
+        t.daemon = True
+        t.start()
+        self.outbound = AsyncOutbound(self.loop, SLOW_PEER_POLICY, compression=self.compression)
+
+    def start_listening(self, stop_event):
+        asyncio.run_coroutine_threadsafe(self.serve(stop_event), self.loop).result()
+
+    async def serve(self, stop_event):
+        server = await asyncio.start_server(
+            lambda reader, writer: self.handle_stream(reader, writer, stop_event),
+            sock=self.listening_socket,
+            backlog=max(10, self.cluster_size),
+        )
+        async with server:
+            await server.serve_forever()
+
+    @staticmethod
+    async def read_frame(reader):
+        (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        check_length(length)
+        return await reader.readexactly(length)
+
+    async def handle_stream(self, reader, writer, stop_event):
+        peer_id = None
+        try:
+            # The first frame of every connection is the id of the connecting peer and the compression it offers
+            peer_id = self.accept_hello(await self.read_frame(reader))
+            writer.write(encode_frame(json.dumps(self.inbound_codecs[peer_id]).encode()))
+            await writer.drain()
+            while not stop_event.is_set():
+                frame = await self.read_frame(reader)
+                # Large frames, and transactions while the verifier is full (submit waits), are routed off the loop
+                if len(frame) > DECODE_INLINE or self.verifier.full():
+                    routed = await self.loop.run_in_executor(None, self.route, peer_id, frame)
+                else:
+                    routed = self.route(peer_id, frame)
+                if routed is not None and not self.dispatcher.offer(*routed):
+                    # The worker of this peer is full - wait for space off the loop (this peer is not read meanwhile)
+                    await self.loop.run_in_executor(None, self.dispatcher.dispatch, *routed)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Close the stream when done
+            writer.close()
+            stop_event.set()  # Set the stop event to signal the node that nodes are starting to close
+        except ValueError as e:
+            # An oversized frame (or a broken hello) - only this stream is dropped, the node keeps running
+            print(f"Dropping the connection from peer {peer_id}: {e}")
+            writer.close()
+
+    async def dial_async(self, peer_id, peer_info):
+        """Connects to a peer, dialling again with exponential backoff - returns the number of attempts"""
+        peer_ip = peer_info['ip']
+        peer_port = peer_info['port']
+        deadline = time.time() + DIAL_TIMEOUT
+        delay = BACKOFF_START
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                reader, writer = await asyncio.open_connection(peer_ip, peer_port)
+                writer.write(encode_frame(self.hello()))
+                await writer.drain()
+                # The peer answers with the compression it accepts for this connection
+                codec = json.loads((await self.read_frame(reader)).decode())
+                self.nodes[peer_id] = writer
+                self.outbound.add(peer_id, writer, codec)
+                print(f"Successfully connected to peer {peer_id}.")
+                return attempts
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                if time.time() + delay > deadline:
+                    print(f"Could not connect to peer {peer_id} at {peer_ip}:{peer_port}: {e}")
+                    return attempts
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, BACKOFF_MAX)
+
+    async def dial_all(self, others):
+        return await asyncio.gather(*(self.dial_async(peer_id, peer_info) for peer_id, peer_info in others))
+
+    def connect_to_all_peers(self):
+        """Dials all peers we are not connected to yet at the same time on the event loop"""
+        others = [
+            (peer_id, peer_info) for peer_id, peer_info in self.peers.items()
+            if peer_id != self.id and peer_id not in self.nodes
+        ]
+        attempts = asyncio.run_coroutine_threadsafe(self.dial_all(others), self.loop).result()
+        self.dial_retries += sum(attempts) - len(attempts)
+        return all(peer_id in self.nodes for peer_id in self.peers if peer_id != self.id)
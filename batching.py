@@ -0,0 +1,89 @@
+"""For sending transactions in batches - the ones broadcast within a short window go out as one message"""
+
+import threading
+import time
+
+WINDOW = 0.002  # Seconds the first transaction of a batch waits for more
+LIMIT = 256  # A batch is sent at once when it has this many transactions
+
+
+class TransactionBatcher:
+    """
+    Collects the transactions to broadcast and hands them to send (as a list) once the oldest one has waited
+    window seconds or limit of them are waiting, so a burst of transactions costs one frame instead of
+    one per transaction. No transaction waits longer than window.
+    """
+
+    def __init__(self, send, window=WINDOW, limit=LIMIT):
+        self.send = send
+        self.window = window
+        self.limit = limit
+        self.condition = threading.Condition()
+        self.sending = threading.Lock()  # Batches are sent one at a time, in the order they were taken
+        self.pending = []
+        self.deadline = None  # When the oldest pending transaction has to be sent
+        self.batches = 0
+        self.transactions = 0
+
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def add(self, transaction):
+        with self.condition:
+            self.pending.append(transaction)
+            if len(self.pending) == 1:
+                self.deadline = time.monotonic() + self.window
+                self.condition.notify_all()
+            # Sent right here if full, or if the timer thread has not woken up in time
+            due = len(self.pending) >= self.limit or time.monotonic() >= self.deadline
+        if due:
+            self.flush()
+
+    def take(self):
+        batch, self.pending, self.deadline = self.pending, [], None
+        if batch:
+            self.batches += 1
+            self.transactions += len(batch)
+        return batch
+
+    def flush(self):
+        """Sends the pending transactions now (e.g. before a block that may hold them is broadcast)"""
+        with self.sending:
+            with self.condition:
+                batch = self.take()
+            if batch:
+                self.send(batch)
+
+    def run(self):
+        """Sends every batch when its window is over"""
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                while self.deadline is not None and self.deadline > time.monotonic():
+                    self.condition.wait(self.deadline - time.monotonic())
+            self.flush()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "window": self.window,
+                "batches": self.batches,
+                "transactions": self.transactions,
+                "mean_batch": self.transactions / self.batches if self.batches else 0.0,
+                "pending": len(self.pending),
+            }
+
+
+class VerifiedBatch:
+    """Collects the signature checks of a received batch, so the wallet gets the whole batch at once"""
+
+    def __init__(self, sender_id, size):
+        self.sender_id = sender_id
+        self.size = size
+        self.results = []  # (transaction, signature_valid) in the order of the batch
+
+    def add(self, transaction, signature_valid):
+        """Records one result - returns True once the whole batch is checked"""
+        self.results.append((transaction, signature_valid))
+        return len(self.results) == self.size
@@ -0,0 +1,387 @@
+"""Micro-benchmarks for the hot paths of a node (run: python benchmark.py <name> [options])"""
+
+import argparse
+import sys
+import time
+
+import config
+
+
+def timed(function, repeat):
+    """Returns the average seconds per call of function over repeat calls"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def sample_transactions(wallet, receiver, count):
+    """Creates count signed transactions from wallet to receiver"""
+    return [
+        wallet.create_transaction(receiver.public_key, "Exchange", i + 1, "benchmark")
+        for i in range(count)
+    ]
+
+
+def bench_codec(args):
+    """Bytes per message and encode/decode cost: jsonpickle inside pickle vs the binary codec"""
+    import pickle
+    from utils import BlockChainUtils
+    from codec import Codec
+    from wallet import Wallet
+    from block import Block
+    from blockchain import Blockchain
+    from message import Message
+
+    sender, receiver = Wallet(), Wallet()
+    transactions = sample_transactions(sender, receiver, args.capacity)
+    block = Block(transactions, "1", sender.public_key, 1)
+    blockchain = Blockchain(sender.public_key)
+    blockchain.add_block(block)
+
+    messages = {
+        "TRANSACTION": Message("TRANSACTION", transactions[0]),
+        "BLOCK": Message("BLOCK", block),
+        "BLOCKCHAIN": Message("BLOCKCHAIN", blockchain),
+    }
+    print(f"{'message':<12} {'path':<10} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+    for name, message in messages.items():
+        old = pickle.dumps(BlockChainUtils.encode(message))
+        new = Codec.encode(message)
+        paths = [
+            ("jsonpickle", old,
+             lambda: pickle.dumps(BlockChainUtils.encode(message)),
+             lambda: BlockChainUtils.decode(pickle.loads(old))),
+            ("codec", new,
+             lambda: Codec.encode(message),
+             lambda: Codec.decode(new)),
+        ]
+        for path, data, encode, decode in paths:
+            print(f"{name:<12} {path:<10} {len(data):>8} "
+                  f"{timed(encode, args.repeat) * 1e6:>10.1f} {timed(decode, args.repeat) * 1e6:>10.1f}")
+
+
+def bench_verify(args):
+    """Signature verification throughput: one by one in this process vs the BatchVerifier process pool"""
+    import threading
+    from wallet import Wallet
+    from verifier import BatchVerifier
+
+    senders = [Wallet() for _ in range(4)]
+    receiver = Wallet()
+    transactions = []
+    for sender in senders:
+        transactions += sample_transactions(sender, receiver, args.repeat // len(senders))
+
+    start = time.perf_counter()
+    for transaction in transactions:
+        receiver.verify_transaction(transaction.sender_address, transaction.payload(), transaction.signature)
+    serial = time.perf_counter() - start
+
+    done = threading.Event()
+    results = []
+
+    def collect(transaction, valid, context):
+        results.append(valid)
+        if len(results) == len(transactions):
+            done.set()
+
+    verifier = BatchVerifier(collect, batch_size=args.batch_size)
+    # Warm up the pool so process start-up is not measured
+    verifier.executor.submit(sum, []).result()
+    start = time.perf_counter()
+    for transaction in transactions:
+        verifier.submit(transaction)
+    done.wait()
+    batched = time.perf_counter() - start
+    verifier.shutdown()
+
+    print(f"{len(transactions)} transactions, batch size {args.batch_size}")
+    print(f"serial:  {len(transactions) / serial:>10.0f} verifications/s")
+    print(f"batched: {len(transactions) / batched:>10.0f} verifications/s ({all(results)=})")
+
+
+def bench_signatures(args):
+    """Sign and verify operations per second for every signature scheme, with and without the key cache"""
+    from signatures import SCHEMES, import_public_key, key_cache
+    from verifier import signing_bytes
+
+    data = signing_bytes({"type": "Exchange", "amount": 10, "nonce": 1, "message": "benchmark"})
+    print(f"{'scheme':<10} {'sign/s':>10} {'verify/s':>10} {'verify/s (no cache)':>20} {'signature bytes':>16}")
+    for name, scheme in SCHEMES.items():
+        private_key_obj, _, public_key = scheme.generate()
+        signature = scheme.sign(private_key_obj, data)
+        sign = timed(lambda: scheme.sign(private_key_obj, data), args.repeat)
+        verify = timed(lambda: scheme.verify(key_cache.get(public_key), data, signature), args.repeat)
+        uncached = timed(lambda: scheme.verify(import_public_key(public_key), data, signature), args.repeat)
+        print(f"{name:<10} {1 / sign:>10.0f} {1 / verify:>10.0f} {1 / uncached:>20.0f} {len(signature):>16}")
+
+
+def bench_bootstrap(args):
+    """Seconds from the first join to a ready cluster of --nodes nodes, then to a full mesh (all on localhost)"""
+    import threading
+    from wallet import Wallet
+    from blockchain import Blockchain
+    from p2p import P2P
+
+    # Ed25519 keys are quick to generate - only the handshake is measured
+    wallets = [Wallet("ed25519") for _ in range(args.nodes)]
+    bootstrap = P2P("127.0.0.1", args.port, wallets[0])
+    bootstrap.id = "id0"
+    bootstrap.peers = {"id0": {"ip": "127.0.0.1", "port": args.port, "public_key": wallets[0].public_key,
+                               "balance": args.nodes * 1000, "stake": 10}}
+    bootstrap.blockchain = Blockchain(wallets[0].public_key)
+    joiners = [P2P("127.0.0.1", args.port + i, wallets[i]) for i in range(1, args.nodes)]
+
+    result = {}
+    bootstrapping = threading.Thread(target=lambda: result.update(elapsed=bootstrap.bootstrap_mode()))
+    bootstrapping.start()
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=joiner.connect_to_bootstrap_node, args=("127.0.0.1", args.port))
+        for joiner in joiners
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - start
+    bootstrapping.join()
+
+    ids = {joiner.id for joiner in joiners}
+    complete = len(ids) == len(joiners) and all(len(joiner.peers) == args.nodes for joiner in joiners)
+    print(f"{args.nodes} nodes: ready in {total:.3f} s "
+          f"(bootstrap side {result['elapsed']:.3f} s, {complete=})")
+
+    # Every node connects to all the others and waits at the readiness barrier
+    nodes = [bootstrap] + joiners
+    stop_event = threading.Event()
+    for node in nodes:
+        t = threading.Thread(target=node.start_listening, args=(stop_event,))
+        t.daemon = True
+        t.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=node.form_mesh) for node in nodes]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - start
+    complete = all(len(node.ready_peers) == args.nodes - 1 for node in nodes)
+    print(f"{args.nodes} nodes: mesh ready in {total:.3f} s "
+          f"({sum(node.dial_retries for node in nodes)} redials, {complete=})")
+
+
+def bench_engines(args):
+    """Messages per second and delivery latency between two local nodes: threaded P2P vs asyncio P2P"""
+    import threading
+    from wallet import Wallet
+    from message import Message
+    from p2p import P2P
+    from async_p2p import AsyncP2P
+
+    wallets = [Wallet("ed25519"), Wallet("ed25519")]
+    print(f"{'engine':<8} {'messages/s':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    for number, engine in enumerate((P2P, AsyncP2P)):
+        port = args.port + 2 * number
+        nodes = [engine("127.0.0.1", port + i, wallets[i]) for i in range(2)]
+        peers = {
+            f"id{i}": {"ip": "127.0.0.1", "port": port + i, "public_key": wallets[i].public_key,
+                       "balance": 0, "stake": 10}
+            for i in range(2)
+        }
+        stop_event = threading.Event()
+        for i, node in enumerate(nodes):
+            node.id, node.peers, node.cluster_size = f"id{i}", peers, 2
+            t = threading.Thread(target=node.start_listening, args=(stop_event,))
+            t.daemon = True
+            t.start()
+        threads = [threading.Thread(target=node.form_mesh) for node in nodes]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # The receiving node's wallet is replaced by a handler that records when every message arrived
+        latencies = []
+        done = threading.Event()
+
+        def received(peer_id, message):
+            latencies.append(time.perf_counter() - message.data)
+            if len(latencies) == args.repeat:
+                done.set()
+
+        nodes[1].dispatcher.handler = received
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            nodes[0].send_to("id1", Message("PING", time.perf_counter()))
+        done.wait()
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        print(f"{engine.__name__:<8} {args.repeat / elapsed:>11.0f} "
+              f"{latencies[len(latencies) // 2] * 1e3:>8.2f} {latencies[int(len(latencies) * 0.99)] * 1e3:>8.2f}")
+        nodes[0].outbound.close()
+
+
+def bench_batching(args):
+    """Frames, socket writes and bytes per transaction when broadcasting a burst: one by one vs batched"""
+    import socket
+    import threading
+    from wallet import Wallet
+    from codec import Codec
+    from framing import encode_frame
+    from message import Message
+    from outbound import Outbound
+    from batching import TransactionBatcher
+
+    sender, receiver = Wallet(), Wallet()
+    transactions = sample_transactions(sender, receiver, args.repeat)
+    print(f"{len(transactions)} transactions, sent {args.interval_us} us apart")
+    print(f"{'path':<16} {'frames/tx':>10} {'writes/tx':>10} {'bytes/tx':>9} {'p99 wait ms':>12} {'max wait ms':>12}")
+    for window in (0, args.window_ms / 1000):
+        local, remote = socket.socketpair()
+        drained = threading.Thread(target=lambda: [None for _ in iter(lambda: remote.recv(1 << 20), b"")])
+        drained.daemon = True
+        drained.start()
+        outbound = Outbound()
+        outbound.add("peer", local)
+        added = {}  # Transaction id: when it was broadcast
+        waits = []
+
+        def send(batch):
+            now = time.perf_counter()
+            waits.extend(now - added[transaction.transaction_id] for transaction in batch)
+            message = Message("TRANSACTION_BATCH", batch) if len(batch) > 1 else Message("TRANSACTION", batch[0])
+            outbound.send("peer", encode_frame(Codec.encode(message)))
+
+        batcher = TransactionBatcher(send, window) if window else None
+        for transaction in transactions:
+            added[transaction.transaction_id] = time.perf_counter()
+            if batcher is not None:
+                batcher.add(transaction)
+            else:
+                send([transaction])
+            if args.interval_us:
+                time.sleep(args.interval_us / 1e6)
+        if batcher is not None:
+            time.sleep(window * 2)  # The last batch goes out when its window is over
+        outbound.flush()
+        stats = outbound.stats()["peers"]["peer"]
+        path = f"batched {window * 1000:g} ms" if window else "one by one"
+        print(f"{path:<16} {stats['sent'] / len(transactions):>10.3f} {stats['writes'] / len(transactions):>10.3f} "
+              f"{stats['sent_bytes'] / len(transactions):>9.0f} "
+              f"{sorted(waits)[int(len(waits) * 0.99)] * 1000:>12.3f} {max(waits) * 1000:>12.3f}")
+        outbound.close()
+
+
+def bench_compact(args):
+    """Bytes per block and the receiver's cost to decode and rebuild it: full block vs header and transaction ids"""
+    from wallet import Wallet
+    from codec import Codec
+    from block import Block
+    from blockchain import Blockchain
+    from message import Message
+    from compact import CompactRelay, compact_block
+
+    sender, receiver = Wallet(), Wallet()
+    transactions = sample_transactions(sender, receiver, args.capacity)
+    block = Block(transactions, "1", sender.public_key, 1)
+    # The receiver already holds every transaction of the block in its pool
+    receiver.set_blockchain(Blockchain(sender.public_key))
+    for transaction in transactions:
+        receiver.transaction_pool.add_transaction(transaction)
+    relay = CompactRelay(receiver, None, None)
+
+    full = Codec.encode(Message("BLOCK", block))
+    compact = Codec.encode(Message("COMPACT_BLOCK", compact_block(block)))
+
+    def rebuild():
+        rebuilt = relay.handle_compact_block("id0", *Codec.decode(compact).data)
+        assert rebuilt.hash_block() == block.current_hash
+
+    def decode():
+        assert Codec.decode(full).data.hash_block() == block.current_hash
+
+    print(f"block of {len(transactions)} transactions")
+    print(f"{'path':<10} {'bytes':>9} {'bytes/tx':>9} {'receive us':>11}")
+    for path, data, receive in (("full", full, decode), ("compact", compact, rebuild)):
+        print(f"{path:<10} {len(data):>9} {len(data) / len(transactions):>9.0f} "
+              f"{timed(receive, args.repeat) * 1e6:>11.1f}")
+
+
+def bench_compression(args):
+    """Ratio and CPU time of every compression codec per message, and the time to send it over a link"""
+    from wallet import Wallet
+    from codec import Codec
+    from block import Block
+    from blockchain import Blockchain
+    from message import Message
+    from framing import encode_frame, HEADER
+    from compact import compact_block
+    from compression import Compression, CODECS
+
+    wallets = [Wallet() for _ in range(args.nodes)]
+
+    def transactions():
+        return [
+            wallets[i % len(wallets)].create_transaction(
+                wallets[(i + 1) % len(wallets)].public_key, "Exchange", i + 1, "benchmark")
+            for i in range(args.capacity)
+        ]
+
+    block = Block(transactions(), "1", wallets[0].public_key, 1)
+    blockchain = Blockchain(wallets[0].public_key)
+    for index in range(1, 11):
+        blockchain.add_block(Block(transactions(), "1", wallets[0].public_key, index))
+    messages = {
+        "TRANSACTION": Message("TRANSACTION", block.transactions[0]),
+        "BLOCK": Message("BLOCK", block),
+        "COMPACT_BLOCK": Message("COMPACT_BLOCK", compact_block(block)),
+        "BLOCKCHAIN": Message("BLOCKCHAIN", blockchain),
+    }
+    link = args.link_mbps * 1e6 / 8  # Bytes per second
+    print(f"{'message':<14} {'codec':<6} {'bytes':>8} {'ratio':>6} {'comp us':>9} {'decomp us':>10} "
+          f"{f'total ms @ {args.link_mbps:g} Mbit/s':>24}")
+    for name, message in messages.items():
+        frame = encode_frame(Codec.encode(message))
+        print(f"{name:<14} {'none':<6} {len(frame):>8} {1:>6.2f} {0:>9.1f} {0:>10.1f} {len(frame) / link * 1e3:>24.2f}")
+        for codec in CODECS:
+            compression = Compression(codec, threshold=0)
+            sent = compression.compress(codec, frame)
+            compress = timed(lambda: compression.compress(codec, frame), args.repeat)
+            decompress = timed(lambda: compression.decompress(codec, sent[HEADER.size:]), args.repeat)
+            total = compress + decompress + len(sent) / link
+            print(f"{name:<14} {codec:<6} {len(sent):>8} {len(frame) / len(sent):>6.2f} {compress * 1e6:>9.1f} "
+                  f"{decompress * 1e6:>10.1f} {total * 1e3:>24.2f}")
+
+
+BENCHMARKS = {
+    "codec": bench_codec,
+    "verify": bench_verify,
+    "signatures": bench_signatures,
+    "bootstrap": bench_bootstrap,
+    "engines": bench_engines,
+    "batching": bench_batching,
+    "compact": bench_compact,
+    "compression": bench_compression,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--nodes", type=int, default=5, help="N")
+    parser.add_argument("--capacity", type=int, default=10, help="CAPACITY")
+    parser.add_argument("--repeat", type=int, default=200, help="Calls per measurement")
+    parser.add_argument("--batch-size", type=int, default=64, help="Batch size of the BatchVerifier")
+    parser.add_argument("--port", type=int, default=45000, help="First port of the local nodes")
+    parser.add_argument("--window-ms", type=float, default=2.0, help="Batching window of the TransactionBatcher")
+    parser.add_argument("--interval-us", type=int, default=0, help="Microseconds between two broadcast transactions")
+    parser.add_argument("--link-mbps", type=float, default=100.0, help="Link speed the sending time is estimated for")
+    args = parser.parse_args()
+
+    # The modules read N and CAPACITY on import, exactly as with running_script.py
+    config.N = args.nodes
+    config.CAPACITY = args.capacity
+
+    sys.exit(BENCHMARKS[args.name](args))
@@ -1,8 +1,12 @@
 """For creating and managing blocks - a container that holds data (including transactions)"""
 
 from config import CAPACITY
+import hashlib
+import json
 import time
-from utils import BlockChainUtils
+from merkle import build_levels, root_of, merkle_proof, verify_proof
+
+HEADER_FIELDS = ("index", "previous_hash", "validator", "timestamp", "merkle_root")  # What the block hash covers
 
 
 class Block:
@@ -16,8 +20,17 @@ class Block:
         self.transactions = transactions
         self.validator = validator  # Public Key of validator
         self.previous_hash = previous_hash
+        self.merkle_root = self.compute_merkle_root()  # Commits to the contents of the transactions
         self.current_hash = self.hash_block()
 
+    def __setattr__(self, name, value):
+        # Changing a header field drops the cached canonical encoding (current_hash is not part of it)
+        if name in HEADER_FIELDS:
+            self.__dict__["canonical_cache"] = None
+        if name == "transactions":
+            self.__dict__["merkle_cache"] = None
+        object.__setattr__(self, name, value)
+
     @staticmethod
     def genesis():
         """
@@ -34,32 +47,91 @@ class Block:
         """
         Will help display block in readable dictionary form
         """
-        data = {}
-        data["index"] = self.index
-        data["previous_hash"] = self.previous_hash
-        data["validator"] = self.validator
-        data["timestamp"] = self.timestamp
+        data = self.payload()
         data["current_hash"] = self.current_hash
-        json_transactions = []
-        for transaction in self.transactions:
-            json_transactions.append(transaction.to_dict())
-        data["transactions"] = json_transactions
         return data
 
+    def header(self):
+        """
+        The fields of the block without its transactions (the transactions are committed to by merkle_root)
+        """
+        return {field: getattr(self, field) for field in HEADER_FIELDS}
+
+    @staticmethod
+    def encode_header(header):
+        """The deterministic byte encoding of a header (extra fields, e.g. current_hash, are left out)"""
+        return json.dumps(
+            {field: header[field] for field in HEADER_FIELDS}, sort_keys=True, separators=(",", ":")
+        ).encode("utf-8")
+
+    @staticmethod
+    def hash_header(header):
+        """
+        The block hash of a header - with the headers alone a client can check the chain of hashes and
+        take the Merkle roots from it to check inclusion proofs
+        """
+        return hashlib.sha256(Block.encode_header(header)).hexdigest()
+
+    def canonical_bytes(self):
+        """
+        The deterministic byte encoding of the header (without current_hash), built once and cached.
+        The transactions are not in it - merkle_root commits to them.
+        """
+        cached = self.__dict__.get("canonical_cache")
+        if cached is None:
+            encoded = Block.encode_header(self.header())
+            cached = (encoded, hashlib.sha256(encoded).hexdigest())
+            self.canonical_cache = cached
+        return cached[0]
+
     def hash_block(self):
         """
-        Creates hash of block
+        Creates hash of block (of its header)
         """
-        data = {}
-        data["index"] = self.index
-        data["previous_hash"] = self.previous_hash
-        data["validator"] = self.validator
-        data["timestamp"] = self.timestamp
-        json_transactions = []
-        for transaction in self.transactions:
-            json_transactions.append(transaction.to_dict())
-        data["transactions"] = json_transactions
-        return BlockChainUtils.hash(data).hexdigest()
+        self.canonical_bytes()
+        return self.canonical_cache[1]
+
+    def merkle_levels(self):
+        """
+        The levels of the Merkle tree over the canonical encodings of the transactions, built once and cached
+        """
+        cached = self.__dict__.get("merkle_cache")
+        # Transactions appended to the list after caching (e.g. in the genesis block) invalidate it too
+        if cached is None or cached[0] != len(self.transactions):
+            levels = build_levels([transaction.canonical_bytes() for transaction in self.transactions])
+            cached = (len(self.transactions), levels)
+            self.merkle_cache = cached
+        return cached[1]
+
+    def compute_merkle_root(self):
+        """
+        Computes the Merkle root of the block's current transactions
+        """
+        return root_of(self.merkle_levels())
+
+    def inclusion_proof(self, transaction_id, position=None):
+        """
+        Returns the proof that a transaction is in the block (None if it is not).
+        The position of the transaction in the block is looked up if not given.
+        """
+        if position is None:
+            for index, transaction in enumerate(self.transactions):
+                if transaction.transaction_id == transaction_id:
+                    position = index
+                    break
+            else:
+                return None
+        elif self.transactions[position].transaction_id != transaction_id:
+            return None
+        return merkle_proof(self.merkle_levels(), position)
+
+    @staticmethod
+    def verify_inclusion(transaction, proof, merkle_root):
+        """
+        Checks a proof produced by inclusion_proof that transaction (with exactly these contents) is in
+        the block with this Merkle root
+        """
+        return verify_proof(transaction.canonical_bytes(), proof, merkle_root)
 
     def payload(self):
         """
@@ -70,6 +142,7 @@ class Block:
         data["previous_hash"] = self.previous_hash
         data["validator"] = self.validator
         data["timestamp"] = self.timestamp
+        data["merkle_root"] = self.merkle_root
         json_transactions = []
         for transaction in self.transactions:
             json_transactions.append(transaction.to_dict())
@@ -0,0 +1,208 @@
+"""For keeping the blocks of the blockchain on disk (append-only) with only the most recent ones in memory"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from codec import Codec
+
+WINDOW = 256  # Blocks kept in memory (most recently used)
+BLOCK_ENTRY = struct.Struct("!QI32s")  # Offset and length of the block in the segment file, block hash
+TRANSACTION_ENTRY = struct.Struct("!32sII")  # Transaction id, height of its block, position in the block
+
+
+def digest_bytes(digest):
+    """The 32 raw bytes of a SHA-256 hex digest (ids not shaped like one are hashed to fit)"""
+    if len(digest) == 64:
+        try:
+            return bytes.fromhex(digest)
+        except ValueError:
+            pass
+    return hashlib.sha256(digest.encode("utf-8")).digest()
+
+
+class BlockStore(Sequence):
+    """
+    Stores blocks in an append-only segment file, with an index file of (offset, length, hash) per height
+    and an index file of (transaction id, height, position) per committed transaction.
+    Both index files are memory-mapped and scanned when the store is opened - no block is decoded for that.
+    Blocks are read lazily through a memory map of the segment file and kept in a bounded window.
+    Behaves like the list of blocks it replaces (len, indexing, slicing, iteration, append).
+    """
+
+    def __init__(self, directory, window=WINDOW):
+        self.directory = directory
+        self.window = window
+        os.makedirs(directory, exist_ok=True)
+        self.segment_path = os.path.join(directory, "blocks.dat")
+        self.index_path = os.path.join(directory, "blocks.idx")
+        self.transactions_path = os.path.join(directory, "transactions.idx")
+        self.lock = threading.RLock()
+        self.cache = OrderedDict()  # Mapping of height to Block, least recently used first
+        self.segment_map = None
+        self.open()
+
+    # ------------------------------ files ------------------------------ #
+
+    def open(self):
+        """Opens the files and scans the indexes"""
+        for path in (self.segment_path, self.index_path, self.transactions_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+        self.segment = open(self.segment_path, "r+b")
+        self.index = open(self.index_path, "r+b")
+        self.transactions = open(self.transactions_path, "r+b")
+        self.scan()
+
+    def scan(self):
+        """Reads the block index - drops entries left incomplete by a crash (e.g. a block without its data)"""
+        segment_size = os.fstat(self.segment.fileno()).st_size
+        self.entries = []  # (offset, length) per height
+        self.heights = {}  # Mapping of block hash to height
+        end = 0
+        for offset, length, block_hash in self.read_entries(self.index, BLOCK_ENTRY):
+            # Blocks are written back to back, so every entry starts where the previous one ended
+            if offset != end or length == 0 or offset + length > segment_size:
+                break
+            end = offset + length
+            self.heights[block_hash.hex()] = len(self.entries)
+            self.entries.append((offset, length))
+        self.index.truncate(len(self.entries) * BLOCK_ENTRY.size)
+        self.index.seek(0, os.SEEK_END)
+        # Transactions of blocks that did not make it are dropped as well
+        count = 0
+        for _, height, _ in self.read_entries(self.transactions, TRANSACTION_ENTRY):
+            if height >= len(self.entries):
+                break
+            count += 1
+        self.transactions.truncate(count * TRANSACTION_ENTRY.size)
+        self.transactions.seek(0, os.SEEK_END)
+        self.segment.truncate(end)
+        self.segment.seek(0, os.SEEK_END)
+        self.remap()
+
+    @staticmethod
+    def read_entries(file, entry):
+        """Yields the complete entries of an index file through a memory map"""
+        size = os.fstat(file.fileno()).st_size
+        size -= size % entry.size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as index_map:
+            yield from entry.iter_unpack(index_map[:size])
+
+    def remap(self):
+        """Maps the segment file again (after it grew)"""
+        if self.segment_map is not None:
+            self.segment_map.close()
+            self.segment_map = None
+        size = os.fstat(self.segment.fileno()).st_size
+        if size > 0:
+            self.segment_map = mmap.mmap(self.segment.fileno(), size, access=mmap.ACCESS_READ)
+
+    def close(self):
+        with self.lock:
+            if self.segment_map is not None:
+                self.segment_map.close()
+                self.segment_map = None
+            for file in (self.segment, self.index, self.transactions):
+                file.close()
+
+    def reset(self):
+        """Deletes every stored block"""
+        with self.lock:
+            self.cache.clear()
+            if self.segment_map is not None:
+                self.segment_map.close()
+                self.segment_map = None
+            for file in (self.segment, self.index, self.transactions):
+                file.truncate(0)
+                file.seek(0)
+            self.entries = []
+            self.heights = {}
+
+    def truncate(self, height):
+        """Deletes the blocks from height on"""
+        with self.lock:
+            for stored in [stored for stored in self.cache if stored >= height]:
+                del self.cache[stored]
+            if self.segment_map is not None:
+                self.segment_map.close()
+                self.segment_map = None
+            # The scan drops the transactions and the data of the blocks that lost their index entries
+            self.index.truncate(height * BLOCK_ENTRY.size)
+            self.scan()
+
+    # ------------------------------ blocks ------------------------------ #
+
+    def append(self, block):
+        """Appends a block (data first, then its index entries, so a crash never indexes missing data)"""
+        with self.lock:
+            data = Codec.encode(block)
+            offset = self.segment.seek(0, os.SEEK_END)
+            self.segment.write(data)
+            self.segment.flush()
+            height = len(self.entries)
+            self.transactions.write(b"".join(
+                TRANSACTION_ENTRY.pack(digest_bytes(transaction.transaction_id), height, position)
+                for position, transaction in enumerate(block.transactions)
+            ))
+            self.transactions.flush()
+            self.index.write(BLOCK_ENTRY.pack(offset, len(data), digest_bytes(block.current_hash)))
+            self.index.flush()
+            self.entries.append((offset, len(data)))
+            self.heights[block.current_hash] = height
+            self.remember(height, block)
+
+    def remember(self, height, block):
+        """Keeps a block in the window, evicting the least recently used one"""
+        self.cache[height] = block
+        self.cache.move_to_end(height)
+        if len(self.cache) > self.window:
+            self.cache.popitem(last=False)
+
+    def load(self, height):
+        """Returns the block at height, from the window or from disk"""
+        with self.lock:
+            block = self.cache.get(height)
+            if block is not None:
+                self.cache.move_to_end(height)
+                return block
+            offset, length = self.entries[height]
+            if self.segment_map is None or offset + length > len(self.segment_map):
+                self.remap()
+            block = Codec.decode(self.segment_map[offset:offset + length])
+            self.remember(height, block)
+            return block
+
+    def height_of(self, block_hash):
+        """Returns the height of a block by its hash (None if it is not stored)"""
+        return self.heights.get(block_hash)
+
+    def load_transaction_index(self):
+        """Returns the mapping of transaction_id to (height, position in block) of every stored transaction"""
+        with self.lock:
+            return {
+                transaction_id.hex(): (height, position)
+                for transaction_id, height, position in self.read_entries(self.transactions, TRANSACTION_ENTRY)
+            }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.load(height) for height in range(*item.indices(len(self.entries)))]
+        if item < 0:
+            item += len(self.entries)
+        if not 0 <= item < len(self.entries):
+            raise IndexError("block index out of range")
+        return self.load(item)
+
+    def __iter__(self):
+        for height in range(len(self.entries)):
+            yield self.load(height)
@@ -11,6 +11,22 @@ class Blockchain:
     def __init__(self, bootstrap_public_key):
         self.chain = [Block.genesis()]
         self.chain[0].transactions.append(self.create_genesis_transaction(bootstrap_public_key))
+        self.chain[0].merkle_root = self.chain[0].compute_merkle_root()
+        self.chain[0].current_hash = self.chain[0].hash_block()  # Covers the genesis transaction through the root
+        self.transaction_index = {}  # Mapping of transaction_id to (position of its block, position in the block)
+        self.index_block(self.chain[0], 0)
+        self.store = None  # BlockStore holding the chain on disk (None: the chain is a list in memory)
+
+    @staticmethod
+    def open(store):
+        """Returns the blockchain held by a BlockStore (e.g. of a restarted node)"""
+        if len(store) == 0:
+            raise ValueError(f"{store.directory} holds no blocks")
+        blockchain = Blockchain.__new__(Blockchain)
+        blockchain.chain = store
+        blockchain.store = store
+        blockchain.transaction_index = store.load_transaction_index()
+        return blockchain
 
     def create_genesis_transaction(self, bootstrap_public_key):
         """Creates the genesis transaction"""
@@ -28,8 +44,97 @@ class Blockchain:
         """Adds a block to the blockchain and executes the transactions in the block"""
         total_fees = block.sum_fees()
         self.chain.append(block)
+        self.index_block(block, len(self.chain) - 1)
         return total_fees
 
+    def persist(self, store):
+        """
+        Moves the chain to a BlockStore. The stored blocks the chain shares are kept as they are - only the
+        blocks after them are appended, so accepting a longer chain writes just its new blocks. Stored blocks
+        the chain does not have (after its tip, or on another fork) are deleted: the balances and stakes we
+        were given do not include them (sync fetches them again if they win).
+        A store holding another chain (another genesis block) is never overwritten.
+        """
+        if len(store) > 0 and store.height_of(self.chain[0].current_hash) != 0:
+            raise ValueError(
+                f"{store.directory} holds the blocks of another blockchain - "
+                "remove it or choose another data directory"
+            )
+        shared = self.shared_prefix(store)
+        if shared < len(store):
+            store.truncate(shared)
+        for block in self.chain[shared:]:
+            store.append(block)
+        self.transaction_index = store.load_transaction_index()
+        self.chain = store
+        self.store = store
+
+    def shared_prefix(self, store):
+        """
+        Returns how many blocks the chain and a store share from the genesis block on. The hash of a block
+        covers the hash of the one before it, so matching hashes at a height mean matching blocks up to it.
+        """
+        height = min(len(store), len(self.chain)) - 1
+        while height >= 0 and store.height_of(self.chain[height].current_hash) != height:
+            height -= 1
+        return height + 1
+
+    def index_block(self, block:Block, position):
+        """Records the transactions of a block (at the given position of the chain) in the transaction index"""
+        for transaction_position, transaction in enumerate(block.transactions):
+            self.transaction_index[transaction.transaction_id] = (position, transaction_position)
+
+    def rebuild_transaction_index(self):
+        """Rebuilds the transaction index from the blocks of the chain (e.g. for a received chain)"""
+        self.transaction_index = {}
+        for position, block in enumerate(self.chain):
+            self.index_block(block, position)
+
+    def contains_transaction(self, transaction_id):
+        """Checks whether a transaction is already committed in the blockchain"""
+        return transaction_id in self.transaction_index
+
+    def block_of_transaction(self, transaction_id):
+        """Returns the block that holds a transaction (None if it is not committed)"""
+        location = self.transaction_index.get(transaction_id)
+        if location is None:
+            return None
+        return self.chain[location[0]]
+
+    def get_transaction(self, transaction_id):
+        """Returns a committed transaction by its id (None if it is not committed)"""
+        location = self.transaction_index.get(transaction_id)
+        if location is None:
+            return None
+        return self.chain[location[0]].transactions[location[1]]
+
+    def prove_transaction(self, transaction_id):
+        """
+        Returns the proof that a committed transaction is in its block, with what is needed to check it
+        (None if the transaction is not committed)
+        """
+        location = self.transaction_index.get(transaction_id)
+        if location is None:
+            return None
+        block = self.chain[location[0]]
+        return {
+            "block_index": block.index,
+            "block_hash": block.current_hash,
+            "header": block.header(),  # Block.hash_header(header) == block_hash
+            "merkle_root": block.merkle_root,
+            "proof": block.inclusion_proof(transaction_id, location[1]),
+        }
+
+    def get_block_by_hash(self, block_hash):
+        """Returns a block by its hash (None if it is not in the chain)"""
+        if self.store is not None:
+            height = self.store.height_of(block_hash)
+            return None if height is None else self.chain[height]
+        for block in self.chain:
+            if block.current_hash == block_hash:
+                return block
+        return None
+
     def get_prevhash(self):
         """Returns the hash of the last block in the blockchain"""
         last_block = self.chain[-1]
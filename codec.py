@@ -0,0 +1,269 @@
+"""Compact binary wire format for the messages exchanged between nodes"""
+
+import base64
+import struct
+from collections.abc import Sequence
+
+from message import Message
+from transaction import Transaction
+from block import Block
+from blockchain import Blockchain
+
+VERSION = 2  # First byte of every encoded message, bumped whenever the layout changes
+
+# Value tags
+NONE = 0
+TRUE = 1
+FALSE = 2
+INT = 3        # zigzag varint
+FLOAT = 4      # 8-byte IEEE double
+STR = 5        # new string, utf-8
+HEX_STR = 6    # new string made of lowercase hex digits (hashes, ids), sent as raw bytes
+KEY_STR = 7    # new string holding a PEM public key, sent as DER
+STR_REF = 8    # string already sent in this message, by position in the string table
+BYTES = 9
+LIST = 10
+DICT = 11
+OBJECT = 12    # schema id followed by the schema's fields
+
+# Schema id: (class, fields in wire order). Only these classes can be decoded.
+SCHEMAS = {
+    1: (Message, ("message_type", "data")),
+    2: (Transaction, ("type", "receiver_address", "sender_address", "signature", "nonce",
+                      "fee", "amount", "message", "transaction_id")),
+    3: (Block, ("index", "timestamp", "transactions", "validator", "previous_hash", "merkle_root",
+                "current_hash")),
+    4: (Blockchain, ("chain",)),
+}
+SCHEMA_IDS = {cls: schema_id for schema_id, (cls, _) in SCHEMAS.items()}
+
+# Called on objects once all their fields are decoded
+def blockchain_decoded(blockchain):
+    blockchain.store = None  # A received chain lives in memory until it is persisted
+    blockchain.rebuild_transaction_index()
+
+
+POST_DECODE = {
+    Blockchain: blockchain_decoded,
+}
+
+DOUBLE = struct.Struct("!d")
+PEM_HEADER = "-----BEGIN PUBLIC KEY-----"
+PEM_FOOTER = "-----END PUBLIC KEY-----"
+
+
+def der_to_pem(der):
+    """Renders a DER public key the way PyCryptodome exports it"""
+    text = base64.b64encode(der).decode("ascii")
+    lines = [text[i:i + 64] for i in range(0, len(text), 64)]
+    return "\n".join([PEM_HEADER] + lines + [PEM_FOOTER])
+
+
+def pem_to_der(string):
+    """Returns the DER bytes of a PEM public key (None if string is not one or would not render back identically)"""
+    if not string.startswith(PEM_HEADER) or not string.endswith(PEM_FOOTER):
+        return None
+    try:
+        der = base64.b64decode(string[len(PEM_HEADER):-len(PEM_FOOTER)].replace("\n", ""), validate=True)
+    except ValueError:
+        return None
+    if der_to_pem(der) != string:
+        return None
+    return der
+
+
+def is_hex(string):
+    """Checks if a string round-trips through bytes.fromhex(...).hex()"""
+    if len(string) % 2 != 0 or len(string) == 0:
+        return False
+    try:
+        return bytes.fromhex(string).hex() == string
+    except ValueError:
+        return False
+
+
+class Encoder:
+    """Writes one value in a single pass"""
+
+    def __init__(self):
+        self.out = bytearray([VERSION])
+        self.strings = {}  # Strings already written, mapped to their position in the string table
+
+    def varint(self, number):
+        while number > 0x7F:
+            self.out.append((number & 0x7F) | 0x80)
+            number >>= 7
+        self.out.append(number)
+
+    def blob(self, data):
+        self.varint(len(data))
+        self.out += data
+
+    def string(self, string):
+        position = self.strings.get(string)
+        if position is not None:
+            self.out.append(STR_REF)
+            self.varint(position)
+            return
+        self.strings[string] = len(self.strings)
+        if is_hex(string):
+            self.out.append(HEX_STR)
+            self.blob(bytes.fromhex(string))
+            return
+        der = pem_to_der(string)
+        if der is not None:
+            self.out.append(KEY_STR)
+            self.blob(der)
+        else:
+            self.out.append(STR)
+            self.blob(string.encode("utf-8"))
+
+    def value(self, value):
+        if value is None:
+            self.out.append(NONE)
+        elif value is True:
+            self.out.append(TRUE)
+        elif value is False:
+            self.out.append(FALSE)
+        elif isinstance(value, int):
+            self.out.append(INT)
+            self.varint(value << 1 if value >= 0 else ((-value) << 1) - 1)
+        elif isinstance(value, float):
+            self.out.append(FLOAT)
+            self.out += DOUBLE.pack(value)
+        elif isinstance(value, str):
+            self.string(value)
+        elif isinstance(value, (bytes, bytearray)):
+            self.out.append(BYTES)
+            self.blob(value)
+        elif isinstance(value, (list, tuple, Sequence)):  # Sequence: e.g. a BlockStore used as a chain
+            self.out.append(LIST)
+            self.varint(len(value))
+            for item in value:
+                self.value(item)
+        elif isinstance(value, dict):
+            self.out.append(DICT)
+            self.varint(len(value))
+            for key, item in value.items():
+                self.value(key)
+                self.value(item)
+        elif type(value) in SCHEMA_IDS:
+            schema_id = SCHEMA_IDS[type(value)]
+            self.out.append(OBJECT)
+            self.varint(schema_id)
+            for field in SCHEMAS[schema_id][1]:
+                self.value(getattr(value, field))
+        else:
+            raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+class Decoder:
+    """Reads back one value written by Encoder"""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.position = 0
+        self.strings = []  # String table, in the order the strings were first written
+
+    def byte(self):
+        byte = self.data[self.position]
+        self.position += 1
+        return byte
+
+    def varint(self):
+        number = 0
+        shift = 0
+        while True:
+            byte = self.byte()
+            number |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return number
+            shift += 7
+
+    def blob(self):
+        length = self.varint()
+        end = self.position + length
+        if end > len(self.data):
+            raise ValueError("Truncated message")
+        data = bytes(self.data[self.position:end])
+        self.position = end
+        return data
+
+    def value(self):
+        tag = self.byte()
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == INT:
+            number = self.varint()
+            return number >> 1 if not number & 1 else -((number + 1) >> 1)
+        if tag == FLOAT:
+            (number,) = DOUBLE.unpack_from(self.data, self.position)
+            self.position += DOUBLE.size
+            return number
+        if tag in (STR, HEX_STR, KEY_STR):
+            data = self.blob()
+            if tag == STR:
+                string = data.decode("utf-8")
+            elif tag == HEX_STR:
+                string = data.hex()
+            else:
+                string = der_to_pem(data)
+            self.strings.append(string)
+            return string
+        if tag == STR_REF:
+            return self.strings[self.varint()]
+        if tag == BYTES:
+            return self.blob()
+        if tag == LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == DICT:
+            result = {}
+            for _ in range(self.varint()):
+                key = self.value()
+                result[key] = self.value()
+            return result
+        if tag == OBJECT:
+            schema_id = self.varint()
+            if schema_id not in SCHEMAS:
+                raise ValueError(f"Unknown schema {schema_id}")
+            cls, fields = SCHEMAS[schema_id]
+            obj = cls.__new__(cls)  # The constructors would regenerate timestamps, ids and hashes
+            for field in fields:
+                setattr(obj, field, self.value())
+            if cls in POST_DECODE:
+                POST_DECODE[cls](obj)
+            return obj
+        raise ValueError(f"Unknown tag {tag}")
+
+
+class Codec:
+    """Encodes and decodes messages (and the objects they carry) in the wire format"""
+
+    @staticmethod
+    def encode(value):
+        """Returns the bytes of a value"""
+        encoder = Encoder()
+        encoder.value(value)
+        return bytes(encoder.out)
+
+    @staticmethod
+    def decode(data):
+        """Recreates a value from its bytes"""
+        if not data or data[0] != VERSION:
+            raise ValueError(f"Unsupported wire format version {data[0] if data else None}")
+        decoder = Decoder(data)
+        decoder.position = 1
+        try:
+            value = decoder.value()
+        except (IndexError, struct.error) as e:
+            raise ValueError(f"Truncated message: {e}") from e
+        except (TypeError, AttributeError, KeyError, RecursionError, OverflowError) as e:
+            # Well-framed but nonsensical, e.g. an unhashable dict key or a Blockchain whose chain is a number
+            raise ValueError(f"Malformed message: {e!r}") from e
+        if decoder.position != len(data):
+            raise ValueError("Trailing bytes after message")
+        return value
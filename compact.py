@@ -0,0 +1,167 @@
+"""For relaying blocks compactly - a block is sent as its header and transaction ids and rebuilt from the pool"""
+
+import threading
+from collections import OrderedDict
+from block import Block
+from message import Message
+
+MAX_PENDING = 16  # Blocks waiting for missing transactions at most (the oldest are given up first)
+
+
+def compact_block(block:Block):
+    """The COMPACT_BLOCK data of a block: (header, hash, transaction ids)"""
+    transaction_ids = [transaction.transaction_id for transaction in block.transactions]
+    return block.header(), block.current_hash, transaction_ids
+
+
+def full_block(header, current_hash, transactions):
+    """Rebuilds a block from its header and transactions (its hashes are checked when it is validated)"""
+    block = Block.__new__(Block)  # The constructor would set a new timestamp and hash
+    for field, value in header.items():
+        setattr(block, field, value)
+    block.transactions = transactions
+    block.current_hash = current_hash
+    return block
+
+
+class CompactRelay:
+    """
+    Every transaction of a block has normally been broadcast already and sits in the receivers' pools, so a
+    block is announced as its header and transaction ids only. The receiver takes the transactions from its
+    pool (or chain) and asks the sender only for the ones it lacks (GET_BLOCK_TRANSACTIONS/BLOCK_TRANSACTIONS).
+    The sender is the peer the block came from (the id of its connection, or its origin with gossip).
+    A block overtakes the transactions still being verified (it is handled first), so the ones the verifier
+    is still checking are waited for rather than asked for: the block is completed when they reach the pool.
+    A rebuilt block is checked like a full one: the leaves of its Merkle tree are the hashes of the transactions'
+    canonical encodings, so a transaction with the right id but other contents changes the Merkle root, which
+    no longer matches the one in the header (the block hash covers the header). If the sender cannot supply
+    the missing transactions either, the block is fetched by the synchronizer.
+    """
+
+    def __init__(self, wallet, send, synchronizer, verifying=None):
+        self.wallet = wallet
+        self.send = send  # send(peer_id, message) sends to one peer
+        self.synchronizer = synchronizer
+        # verifying(transaction_id) checks whether a received transaction is still on its way to the pool
+        self.verifying = verifying or (lambda transaction_id: False)
+        self.lock = threading.Lock()
+        # Block hash: [peer id, header, transaction ids, [transaction or None], asked the sender for the rest]
+        self.pending = OrderedDict()
+        self.received = 0
+        self.complete = 0  # Rebuilt from the pool without asking for anything
+        self.awaited = 0  # Waited for transactions that were still being verified
+        self.requested = 0
+        self.missing = 0  # Transactions asked for
+        self.fallbacks = 0
+
+    def lookup(self, transaction_id):
+        """A transaction we hold (pending in the pool or already in the chain), or None"""
+        with self.wallet.lock:
+            transaction = self.wallet.transaction_pool.transactions.get(transaction_id)
+            if transaction is None:
+                transaction = self.wallet.blockchain.get_transaction(transaction_id)
+            return transaction
+
+    def fill(self, transaction_ids, transactions):
+        """
+        Looks up the transactions of a block still missing from transactions (in place).
+        Returns the ids of the ones we neither hold nor are verifying.
+        """
+        missing = []
+        for position, transaction_id in enumerate(transaction_ids):
+            if transactions[position] is None:
+                transactions[position] = self.lookup(transaction_id)
+                if transactions[position] is None and not self.verifying(transaction_id):
+                    missing.append(transaction_id)
+        return missing
+
+    def handle_compact_block(self, peer_id, header, current_hash, transaction_ids):
+        """Peer peer_id sent a block - returns it rebuilt, or None if it waits for transactions (verified or asked for)"""
+        transactions = [None] * len(transaction_ids)
+        with self.lock:
+            missing = self.fill(transaction_ids, transactions)
+            self.received += 1
+            if all(transaction is not None for transaction in transactions):
+                self.complete += 1
+                return full_block(header, current_hash, transactions)
+            self.pending[current_hash] = [peer_id, header, transaction_ids, transactions, bool(missing)]
+            while len(self.pending) > MAX_PENDING:
+                self.pending.popitem(last=False)
+            if missing:
+                self.requested += 1
+                self.missing += len(missing)
+            else:
+                self.awaited += 1
+        if missing:
+            self.send(peer_id, Message("GET_BLOCK_TRANSACTIONS", (current_hash, missing)))
+        return None
+
+    def transactions_arrived(self):
+        """
+        Called once received transactions were handled - returns the waiting blocks that are complete now
+        (oldest first). The ones still missing transactions nobody is verifying ask the sender for them.
+        """
+        blocks = []
+        requests = []
+        with self.lock:
+            for block_hash, entry in list(self.pending.items()):
+                peer_id, header, transaction_ids, transactions, asked = entry
+                if asked:
+                    continue  # Completed by the answer of the sender
+                missing = self.fill(transaction_ids, transactions)
+                if all(transaction is not None for transaction in transactions):
+                    del self.pending[block_hash]
+                    blocks.append(full_block(header, block_hash, transactions))
+                elif missing:
+                    entry[4] = True
+                    self.requested += 1
+                    self.missing += len(missing)
+                    message = Message("GET_BLOCK_TRANSACTIONS", (block_hash, missing))
+                    requests.append((peer_id, message))
+        for peer_id, message in requests:
+            self.send(peer_id, message)
+        return blocks
+
+    def handle_get_block_transactions(self, peer_id, block_hash, transaction_ids):
+        transactions = [self.lookup(transaction_id) for transaction_id in transaction_ids]
+        found = [transaction for transaction in transactions if transaction is not None]
+        self.send(peer_id, Message("BLOCK_TRANSACTIONS", (block_hash, found)))
+
+    def handle_block_transactions(self, peer_id, block_hash, found):
+        """Returns the block once its missing transactions arrived, or None"""
+        with self.lock:
+            entry = self.pending.get(block_hash)
+            if entry is None or entry[0] != peer_id:
+                return None  # Not asked for, or not from this peer
+            del self.pending[block_hash]
+            sender_id, header, transaction_ids, transactions, _ = entry
+            found = {transaction.transaction_id: transaction for transaction in found}
+            for position, transaction_id in enumerate(transaction_ids):
+                if transactions[position] is None:
+                    transactions[position] = found.get(transaction_id)
+            missing = self.fill(transaction_ids, transactions)
+            if not missing and any(transaction is None for transaction in transactions):
+                # The rest is still being verified - completed once it reaches the pool
+                entry[4] = False
+                self.pending[block_hash] = entry
+                return None
+            if missing:
+                self.fallbacks += 1
+        if missing:
+            # The sender lacks them too - fetch the whole block (and any before it) the usual way
+            self.synchronizer.handle_status(sender_id, header["index"], block_hash)
+            return None
+        return full_block(header, block_hash, transactions)
+
+    def stats(self):
+        """Returns how many compact blocks were rebuilt at once, and how many needed transactions from the sender"""
+        with self.lock:
+            return {
+                "received": self.received,
+                "complete": self.complete,
+                "awaited": self.awaited,
+                "requested": self.requested,
+                "missing_transactions": self.missing,
+                "fallbacks": self.fallbacks,
+                "pending": len(self.pending),
+            }
@@ -0,0 +1,131 @@
+"""For compressing large messages on the connections whose two ends agreed on a codec when they connected"""
+
+import lzma
+import threading
+import time
+import zlib
+from framing import HEADER, encode_frame
+
+THRESHOLD = 1024  # Payloads smaller than this (e.g. single transactions) are sent as they are
+ZLIB_LEVEL = 6
+MAX_SIZE = 64 * 1024 * 1024  # Bytes a received payload may decompress to (bigger ones are rejected)
+
+
+def zlib_decompress(data, limit):
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, limit)
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"Payload decompresses to more than {limit} bytes")
+    if not decompressor.eof:
+        raise ValueError("Truncated zlib payload")
+    return result
+
+
+def lzma_decompress(data, limit):
+    decompressor = lzma.LZMADecompressor()
+    result = decompressor.decompress(data, max_length=limit)
+    if not decompressor.eof:
+        if decompressor.needs_input:
+            raise ValueError("Truncated lzma payload")
+        raise ValueError(f"Payload decompresses to more than {limit} bytes")
+    return result
+
+# Name: (marker, compress, decompress with a size limit). The marker is the first byte of a compressed payload - it never
+# clashes with the first byte of an uncompressed one, which is the codec version.
+CODECS = {
+    "zlib": (0xF1, lambda data: zlib.compress(data, ZLIB_LEVEL), zlib_decompress),
+    "lzma": (0xF2, lzma.compress, lzma_decompress),  # Smaller, but several times slower (for slow links)
+}
+MARKERS = {marker: name for name, (marker, _, _) in CODECS.items()}
+
+
+class Compression:
+    """
+    The dialling node offers its codec in the first frame of a connection and the listening node answers
+    with the codec it accepts (None: the connection stays uncompressed). Frames of at least threshold bytes
+    are then compressed on that connection, unless compressing does not make them smaller. Counts the bytes
+    before and after and the time spent compressing and decompressing every codec. A received payload that
+    would decompress to more than max_size bytes is rejected (ValueError) without inflating it further.
+    """
+
+    def __init__(self, codec=None, threshold=THRESHOLD, max_size=MAX_SIZE):
+        if codec is not None and codec not in CODECS:
+            raise ValueError(f"Unknown compression {codec}")
+        self.codec = codec  # The codec this node offers and accepts (None: none)
+        self.threshold = threshold
+        self.max_size = max_size  # A peer cannot make us inflate a small frame beyond this
+        self.lock = threading.Lock()
+        self.counts = {name: {
+            "compressed": 0, "small": 0, "incompressible": 0, "raw_bytes": 0, "compressed_bytes": 0,
+            "compress_seconds": 0.0, "decompressed": 0, "decompress_seconds": 0.0,
+        } for name in CODECS}
+
+    def offer(self):
+        """The codecs offered when dialling"""
+        return [self.codec] if self.codec is not None else []
+
+    def choose(self, offered):
+        """The codec accepted for a connection whose dialler offered these (None if none fits)"""
+        return self.codec if self.codec in offered else None
+
+    def compress(self, codec, frame):
+        """Returns the frame to send on a connection using codec (the frame itself if it is not compressed)"""
+        if codec is None:
+            return frame
+        payload = memoryview(frame)[HEADER.size:]
+        if len(payload) < self.threshold:
+            with self.lock:
+                self.counts[codec]["small"] += 1
+            return frame
+        marker, compress, _ = CODECS[codec]
+        start = time.perf_counter()
+        data = bytes([marker]) + compress(payload)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            counts = self.counts[codec]
+            counts["compress_seconds"] += elapsed
+            if len(data) >= len(payload):
+                counts["incompressible"] += 1
+                return frame
+            counts["compressed"] += 1
+            counts["raw_bytes"] += len(payload)
+            counts["compressed_bytes"] += len(data)
+        return encode_frame(data)
+
+    def decompress(self, codec, payload):
+        """Returns the payload of a frame received on a connection using codec, decompressed if it was"""
+        if not payload or payload[0] not in MARKERS:
+            return payload
+        name = MARKERS[payload[0]]
+        if name != codec:
+            raise ValueError(f"Payload compressed with {name}, which was not agreed on")
+        start = time.perf_counter()
+        try:
+            data = CODECS[name][2](memoryview(payload)[1:], self.max_size)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise ValueError(f"Corrupt {name} payload: {e}")
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.counts[name]["decompressed"] += 1
+            self.counts[name]["decompress_seconds"] += elapsed
+        return data
+
+    def stats(self):
+        """Returns the compression ratio and the time per message of every codec in use"""
+        with self.lock:
+            stats = {"codec": self.codec, "threshold": self.threshold}
+            for name, counts in self.counts.items():
+                attempts = counts["compressed"] + counts["incompressible"]
+                if not (attempts or counts["small"] or counts["decompressed"]):
+                    continue
+                stats[name] = {
+                    "compressed": counts["compressed"],
+                    "small": counts["small"],
+                    "incompressible": counts["incompressible"],
+                    "ratio": counts["raw_bytes"] / counts["compressed_bytes"] if counts["compressed_bytes"] else 0.0,
+                    "saved_bytes": counts["raw_bytes"] - counts["compressed_bytes"],
+                    "compress_us": counts["compress_seconds"] / max(1, attempts) * 1e6,
+                    "decompressed": counts["decompressed"],
+                    "decompress_us": counts["decompress_seconds"] / max(1, counts["decompressed"]) * 1e6,
+                }
+            return stats
@@ -1,2 +1,13 @@
 N = None
-CAPACITY = None
\ No newline at end of file
+CAPACITY = None
+STAKE = 10  # Stake of every node when the cluster starts
+SIGNATURE_SCHEME = "rsa"  # Scheme of the wallets' keys (see signatures.SCHEMES)
+GOSSIP_FANOUT = None  # Peers a message is forwarded to by gossip (None: sent to every peer, 0: ln(N) + 2)
+SLOW_PEER_POLICY = "drop"  # What happens when a peer's outbound queue is full ("drop" its frames or "disconnect": send it nothing more)
+NETWORK_ENGINE = "threads"  # "threads": a thread per connection (p2p.P2P), "asyncio": one event loop (async_p2p.AsyncP2P)
+BATCH_WINDOW = 0  # Seconds transactions are collected into one TRANSACTION_BATCH message (0: sent one by one)
+COMPACT_BLOCKS = False  # Blocks are broadcast with every transaction (True: as their header and transaction ids)
+COMPRESSION = None  # Codec offered for large messages ("zlib" or "lzma", see compression.CODECS; None: none)
+COMPRESSION_THRESHOLD = 1024  # Messages smaller than this many bytes are never compressed
+VERIFIER_PROCESSES = None  # Processes verifying signatures per node (None: one per core - lower it for many local nodes)
+DATA_DIR = None  # Directory of the nodes' block stores (None: the blockchain is kept in memory only)
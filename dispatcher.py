@@ -0,0 +1,109 @@
+"""For handing received messages to the wallet through a bounded pool of worker threads"""
+
+import threading
+import zlib
+from collections import deque
+
+WORKERS = 4  # Number of worker threads
+QUEUE_SIZE = 1000  # Maximum queued messages per lane of a worker
+PRIORITY_TYPES = {"BLOCK", "COMPACT_BLOCK", "BLOCK_TRANSACTIONS", "BLOCKCHAIN", "HEADERS", "BLOCKS"}  # Handled before any queued transaction
+
+
+class Lane:
+    """The queues of one worker - a priority queue (blocks) and a normal queue (transactions)"""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.condition = threading.Condition()
+        self.priority = deque()
+        self.normal = deque()
+        self.dropped = 0
+        self.processed = 0
+
+    def put(self, message, priority, timeout=None):
+        """Queues a message - blocks while the queue is full (drops it if timeout expires first)"""
+        queue = self.priority if priority else self.normal
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(queue) < self.queue_size, timeout):
+                self.dropped += 1
+                return False
+            queue.append(message)
+            self.condition.notify_all()
+            return True
+
+    def offer(self, message, priority):
+        """Queues a message if there is space - never blocks. Returns False if the queue is full."""
+        queue = self.priority if priority else self.normal
+        with self.condition:
+            if len(queue) >= self.queue_size:
+                return False
+            queue.append(message)
+            self.condition.notify_all()
+            return True
+
+    def get(self):
+        """Returns the next message, priority messages first - blocks while both queues are empty"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.priority or self.normal)
+            message = self.priority.popleft() if self.priority else self.normal.popleft()
+            self.condition.notify_all()  # Wake up connections waiting for space
+            return message
+
+
+class Dispatcher:
+    """
+    Every peer is pinned to one worker, so the messages of a peer are handled in the order they arrived
+    (blocks may overtake queued transactions). Connections block when their worker is full.
+    """
+
+    def __init__(self, handler, workers=WORKERS, queue_size=QUEUE_SIZE, drop_timeout=None):
+        self.handler = handler  # Called with the sender id and every decoded message
+        self.drop_timeout = drop_timeout  # None: wait for space as long as needed, else drop after that many seconds
+        self.lanes = [Lane(queue_size) for _ in range(workers)]
+        for lane in self.lanes:
+            t = threading.Thread(target=self.work, args=(lane,))
+            t.daemon = True
+            t.start()
+
+    def lane_of(self, peer_id):
+        """Returns the lane a peer is pinned to (the same for the lifetime of the node)"""
+        return self.lanes[zlib.crc32(str(peer_id).encode()) % len(self.lanes)]
+
+    def dispatch(self, peer_id, message):
+        """Queues a decoded message received from peer_id - returns False if it was dropped"""
+        priority = message.message_type in PRIORITY_TYPES
+        return self.lane_of(peer_id).put((peer_id, message), priority, self.drop_timeout)
+
+    def offer(self, peer_id, message):
+        """Queues a decoded message only if its worker has space - returns False (nothing queued) if not"""
+        priority = message.message_type in PRIORITY_TYPES
+        return self.lane_of(peer_id).offer((peer_id, message), priority)
+
+    def work(self, lane):
+        """Worker loop"""
+        while True:
+            peer_id, message = lane.get()
+            try:
+                self.handler(peer_id, message)
+            except Exception as e:
+                print(f"Error while handling {message.message_type} message: {e}")
+            with lane.condition:
+                lane.processed += 1
+
+    def stats(self):
+        """Returns the queue depths, drop and processed counts of every worker"""
+        lanes = []
+        for lane in self.lanes:
+            with lane.condition:
+                lanes.append({
+                    "priority": len(lane.priority),
+                    "normal": len(lane.normal),
+                    "dropped": lane.dropped,
+                    "processed": lane.processed,
+                })
+        return {
+            "queued": sum(lane["priority"] + lane["normal"] for lane in lanes),
+            "dropped": sum(lane["dropped"] for lane in lanes),
+            "processed": sum(lane["processed"] for lane in lanes),
+            "lanes": lanes,
+        }
@@ -0,0 +1,79 @@
+"""For splitting the byte stream of a connection into length-prefixed messages (frames)"""
+
+import struct
+from collections import deque
+
+HEADER = struct.Struct("!I")  # Every frame starts with its payload length (4 bytes, big-endian)
+CHUNK_SIZE = 65536  # Bytes asked from the socket per recv
+MAX_FRAME = 64 * 1024 * 1024  # Largest payload a frame may announce (a bigger length means a broken or hostile peer)
+
+
+def encode_frame(payload):
+    """Prefixes a payload (bytes) with its length so the receiver knows where it ends"""
+    return HEADER.pack(len(payload)) + payload
+
+
+def check_length(length):
+    """Raises ValueError if a frame announces a payload bigger than MAX_FRAME"""
+    if length > MAX_FRAME:
+        raise ValueError(f"Frame of {length} bytes is bigger than the limit of {MAX_FRAME}")
+
+
+def send_frame(sock, payload):
+    """Sends a payload as one frame"""
+    sock.sendall(encode_frame(payload))
+
+
+class FrameDecoder:
+    """
+    Buffers the bytes received from a connection and yields complete frames.
+    One recv may hold several frames or only part of one, both are handled.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.buffer = bytearray()  # Received bytes that do not yet form a complete frame
+        self.chunk = bytearray(chunk_size)  # Reused for every recv_into
+        self.chunk_view = memoryview(self.chunk)
+        self.pending = deque()  # Complete frames not handed out yet
+
+    def feed(self, data):
+        """Adds received bytes to the buffer and extracts the complete frames"""
+        self.buffer += data
+        self.extract_frames()
+
+    def extract_frames(self):
+        """Moves every complete frame from the buffer to the pending frames - raises ValueError on an oversized one"""
+        start = 0
+        available = len(self.buffer)
+        while available - start >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, start)
+            check_length(length)  # Never buffer up to 4 GiB for one frame
+            end = start + HEADER.size + length
+            if end > available:
+                break
+            self.pending.append(bytes(self.buffer[start + HEADER.size:end]))
+            start = end
+        if start:
+            del self.buffer[:start]
+
+    def read_from(self, sock):
+        """Receives once from the socket - raises EOFError when the peer has closed the connection"""
+        received = sock.recv_into(self.chunk)
+        if received == 0:
+            raise EOFError("Connection closed by peer")
+        self.feed(self.chunk_view[:received])
+        return received
+
+    def next_frame(self, sock):
+        """Returns the next frame, receiving from the socket until one is complete"""
+        while not self.pending:
+            self.read_from(sock)
+        return self.pending.popleft()
+
+    def receive(self, sock):
+        """Returns all complete frames, receiving from the socket until there is at least one"""
+        while not self.pending:
+            self.read_from(sock)
+        frames = list(self.pending)
+        self.pending.clear()
+        return frames
@@ -0,0 +1,195 @@
+"""For spreading messages over the cluster by gossip - every node forwards a new message to a few random peers"""
+
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from codec import Codec
+from framing import encode_frame
+from message import Message
+
+SEEN_SIZE = 65536  # Message ids remembered (the oldest are forgotten first)
+MAX_HOPS = 32  # A message is not forwarded further than this
+REPAIR_INTERVAL = 1.0  # Seconds between two summaries of our pool sent to a random peer
+MAX_SUMMARY = 4096  # Transaction ids per summary
+MAX_REJECTED = 65536  # Ids of transactions our wallet rejected, never asked for again (the oldest are forgotten first)
+
+
+def default_fanout(cluster_size):
+    """A fanout that reaches every node with high probability: ln(N) + 2 peers"""
+    return max(1, min(cluster_size - 1, math.ceil(math.log(cluster_size)) + 2))
+
+
+class Gossip:
+    """
+    Every message is wrapped in a GOSSIP envelope (id, origin, hops, encoded message). The first time a node
+    sees an id it hands the message on and forwards the envelope to fanout random peers (not the one it came
+    from); copies that arrive later are dropped. A message costs O(N * fanout) sends in total instead of every
+    node being sent everything by its origin.
+    """
+
+    def __init__(self, node_id, nodes, fanout, send, seen_size=SEEN_SIZE):
+        self.id = node_id
+        self.nodes = nodes  # The peers to forward to (iterating it gives their ids)
+        self.fanout = fanout
+        self.send = send  # send(peer_id, frame) queues an encoded frame for one peer
+        self.seen_size = seen_size
+        self.seen = OrderedDict()  # Message ids, least recently seen first
+        self.lock = threading.Lock()
+        self.published = 0
+        self.received = 0
+        self.duplicates = 0
+        self.forwarded = 0
+        self.hops = Counter()  # Number of messages received at every hop count
+
+    @staticmethod
+    def message_id(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def remember(self, message_id):
+        """Records an id - returns False if it was seen before"""
+        if message_id in self.seen:
+            self.seen.move_to_end(message_id)
+            return False
+        self.seen[message_id] = None
+        if len(self.seen) > self.seen_size:
+            self.seen.popitem(last=False)
+        return True
+
+    def publish(self, message):
+        """Starts spreading a message of this node"""
+        data = Codec.encode(message)
+        message_id = self.message_id(data)
+        with self.lock:
+            self.remember(message_id)
+            self.published += 1
+        self.forward(message_id, self.id, 0, data, {self.id})
+
+    def receive(self, peer_id, envelope):
+        """Handles an envelope from peer_id - returns the message inside it, or None if it was seen before"""
+        message_id, origin, hops, data = envelope
+        with self.lock:
+            if not self.remember(message_id):
+                self.duplicates += 1
+                return None
+            self.received += 1
+            self.hops[hops] += 1
+        self.forward(message_id, origin, hops, data, {peer_id, origin})
+        return Codec.decode(data)
+
+    def forward(self, message_id, origin, hops, data, exclude):
+        if hops >= MAX_HOPS:
+            return
+        candidates = [peer_id for peer_id in list(self.nodes) if peer_id not in exclude]
+        targets = random.sample(candidates, min(self.fanout, len(candidates)))
+        if not targets:
+            return
+        frame = encode_frame(Codec.encode(Message("GOSSIP", (message_id, origin, hops + 1, data))))
+        for peer_id in targets:
+            self.send(peer_id, frame)
+        with self.lock:
+            self.forwarded += len(targets)
+
+    def stats(self):
+        """Returns the fanout, message counts, duplicate rate and hop counts"""
+        with self.lock:
+            arrivals = self.received + self.duplicates
+            hops = sum(count * hops for hops, count in self.hops.items())
+            return {
+                "fanout": self.fanout,
+                "published": self.published,
+                "received": self.received,
+                "duplicates": self.duplicates,
+                "duplicate_rate": self.duplicates / arrivals if arrivals else 0.0,
+                "forwarded": self.forwarded,
+                "mean_hops": hops / self.received if self.received else 0.0,
+                "max_hops": max(self.hops, default=0),
+                "seen": len(self.seen),
+            }
+
+
+class TransactionRepair:
+    """
+    Gossip reaches every node only with high probability, and a transaction that missed a node is never sent
+    to it again (a missed block is caught up by sync). So every interval seconds a node sends the ids of the
+    transactions in its pool to one random peer (POOL_IDS). The peer asks for the ones it has neither in its
+    pool nor in its chain (GET_TRANSACTIONS) and gets them as a TRANSACTION_BATCH, which is verified and
+    handled like any other batch. The pools of all nodes converge, so none waits on a block it cannot check.
+    Transactions our wallet rejected are remembered, so a peer holding one does not make us ask for it forever.
+    """
+
+    def __init__(self, wallet, nodes, send, interval=REPAIR_INTERVAL, max_rejected=MAX_REJECTED):
+        self.wallet = wallet
+        self.nodes = nodes  # The peers (iterating it gives their ids)
+        self.send = send  # send(peer_id, message) sends to one peer
+        self.interval = interval
+        self.max_rejected = max_rejected
+        self.lock = threading.Lock()
+        self.rejected = OrderedDict()  # Ids of the transactions our wallet rejected, oldest first
+        self.summaries = 0
+        self.requested = 0  # Transactions we asked for
+        self.served = 0  # Transactions we sent to peers that lacked them
+
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.wallet.lock:
+                ids = list(self.wallet.transaction_pool.transactions)[:MAX_SUMMARY]
+            peers = list(self.nodes)
+            if not ids or not peers:
+                continue
+            with self.lock:
+                self.summaries += 1
+            self.send(random.choice(peers), Message("POOL_IDS", ids))
+
+    def handle_pool_ids(self, peer_id, ids):
+        """Peer peer_id sent the ids in its pool - asks it for the ones we have neither seen nor rejected"""
+        with self.wallet.lock:
+            pool = self.wallet.transaction_pool.transactions
+            blockchain = self.wallet.blockchain
+            missing = [id for id in ids if id not in pool and not blockchain.contains_transaction(id)]
+        with self.lock:
+            missing = [id for id in missing if id not in self.rejected]
+            self.requested += len(missing)
+        if missing:
+            self.send(peer_id, Message("GET_TRANSACTIONS", missing))
+
+    def transactions_handled(self, transactions):
+        """Received transactions reached the wallet - remembers the ones it did not take (rejected)"""
+        with self.wallet.lock:
+            pool = self.wallet.transaction_pool.transactions
+            blockchain = self.wallet.blockchain
+            rejected = [
+                transaction.transaction_id for transaction in transactions
+                if transaction.transaction_id not in pool and not blockchain.contains_transaction(transaction.transaction_id)
+            ]
+        with self.lock:
+            for id in rejected:
+                self.rejected[id] = None
+                self.rejected.move_to_end(id)
+            while len(self.rejected) > self.max_rejected:
+                self.rejected.popitem(last=False)
+
+    def handle_get_transactions(self, peer_id, ids):
+        with self.wallet.lock:
+            pool = self.wallet.transaction_pool.transactions
+            found = [pool[id] for id in ids if id in pool]
+        if found:
+            with self.lock:
+                self.served += len(found)
+            self.send(peer_id, Message("TRANSACTION_BATCH", found))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "summaries": self.summaries,
+                "requested": self.requested,
+                "served": self.served,
+                "rejected": len(self.rejected),
+            }
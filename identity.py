@@ -0,0 +1,36 @@
+"""For saving who a node is (its keys, ID and peer table) next to its block store, so it can be restarted on it"""
+
+import json
+import os
+
+FILE = "identity.json"
+
+
+def save_identity(directory, id, wallet, peers):
+    """
+    Saves the keys of the wallet, the ID of the node and the address and key of every peer.
+    Balances and stakes are not saved - they are rebuilt from the snapshots and the stored blocks.
+    """
+    identity = {
+        "id": id,
+        "signature_scheme": wallet.signature_scheme.name,
+        "private_key": wallet.private_key,
+        "peers": {
+            peer_id: {"ip": peer["ip"], "port": peer["port"], "public_key": peer["public_key"]}
+            for peer_id, peer in peers.items()
+        },
+    }
+    path = os.path.join(directory, FILE)
+    # Written to a temporary file first so a crash never leaves half an identity
+    with open(path + ".tmp", "w") as file:
+        json.dump(identity, file)
+    os.replace(path + ".tmp", path)
+
+
+def load_identity(directory):
+    """Returns the identity saved in a directory (None if the node never ran on it)"""
+    path = os.path.join(directory, FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
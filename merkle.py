@@ -0,0 +1,73 @@
+"""For building Merkle trees over the transactions of a block and proving that a transaction is in a block"""
+
+import hashlib
+
+LEAF_PREFIX = b"\x00"  # Leaves and inner nodes are hashed differently so one cannot pass for the other
+NODE_PREFIX = b"\x01"
+EMPTY_ROOT = hashlib.sha256(b"").hexdigest()
+
+
+def hash_leaf(leaf):
+    """Hash of a leaf (the canonical encoding of a transaction, bytes)"""
+    return hashlib.sha256(LEAF_PREFIX + leaf).digest()
+
+
+def hash_node(left, right):
+    """Hash of an inner node"""
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def build_levels(leaves):
+    """
+    Returns every level of the tree, leaves first and root last.
+    A node without a sibling is moved up to the next level unchanged.
+    """
+    level = [hash_leaf(leaf) for leaf in leaves]
+    levels = [level]
+    while len(level) > 1:
+        next_level = [hash_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2 == 1:
+            next_level.append(level[-1])
+        level = next_level
+        levels.append(level)
+    return levels
+
+
+def root_of(levels):
+    """Returns the root (hex) of a tree built by build_levels"""
+    if not levels[-1]:
+        return EMPTY_ROOT
+    return levels[-1][0].hex()
+
+
+def merkle_root(leaves):
+    """Returns the Merkle root (hex) of a list of leaves"""
+    return root_of(build_levels(leaves))
+
+
+def merkle_proof(levels, position):
+    """
+    Returns the inclusion proof of the leaf at position: the sibling hashes (hex) from the leaf up to the root,
+    each with the side it sits on
+    """
+    proof = []
+    for level in levels[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append([level[sibling].hex(), "left" if sibling < position else "right"])
+        position //= 2
+    return proof
+
+
+def verify_proof(leaf, proof, root):
+    """Checks that leaf is a leaf of the tree with the given root"""
+    current = hash_leaf(leaf)
+    for sibling, side in proof:
+        sibling = bytes.fromhex(sibling)
+        if side == "left":
+            current = hash_node(sibling, current)
+        elif side == "right":
+            current = hash_node(current, sibling)
+        else:
+            return False
+    return current.hex() == root
@@ -1,112 +1,143 @@
 import json
+import os
 import threading
-from queue import Queue
+from config import DATA_DIR, NETWORK_ENGINE
 from p2p import P2P
+from async_p2p import AsyncP2P
 from wallet import Wallet
+from blockchain import Blockchain
+from block_store import BlockStore
+from identity import load_identity, save_identity
+from snapshot import SnapshotStore
 from commands import read_input, process_command
+from scheduler import Scheduler
 
 class Node:
     # Class that represents the each node of the cluster    
     def __init__(self, ip, port, stop_event):
         self.ip = ip
         self.port = port
-        self.wallet = Wallet()
-        self.p2p = P2P(self.ip, self.port, self.wallet)
-        self.p2p.p2p_network_init(stop_event)
-        self.wallet.set_peers(self.p2p.peers, self.p2p.nodes)
+        # Keep the blockchain, the state snapshots and the identity of the node on disk (one directory per node)
+        directory = os.path.join(DATA_DIR, f"{self.ip}_{self.port}") if DATA_DIR is not None else None
+        identity = load_identity(directory) if directory is not None else None
+        self.restarted = identity is not None  # Runs again on the blockchain it stored
+        if self.restarted:
+            self.wallet = Wallet(identity["signature_scheme"], identity["private_key"])
+        else:
+            self.wallet = Wallet()
+        engine = AsyncP2P if NETWORK_ENGINE == "asyncio" else P2P
+        self.p2p = engine(self.ip, self.port, self.wallet)
+        self.p2p.p2p_network_init(stop_event, identity)
+        self.wallet.set_peers(self.p2p.peers, self.p2p.outbound)
+        if directory is not None:
+            store = BlockStore(directory)
+            if self.restarted:
+                self.p2p.blockchain = Blockchain.open(store)
+            else:
+                self.p2p.blockchain.persist(store)
+                save_identity(directory, self.p2p.id, self.wallet, self.p2p.peers)
+            self.wallet.set_snapshots(SnapshotStore(os.path.join(directory, "snapshots")))
         self.wallet.set_blockchain(self.p2p.blockchain)
+        # Start from the newest snapshot of the chain (a restarted node executes only the blocks after it)
+        self.wallet.restore_state()
         self.p2p.set_wallet(self.wallet)
+        # Peers that are behind (e.g. restarted with an older stored chain) catch up from us
+        self.p2p.announce_status()
 
         # Start Blockchaining
         self.blockchaining(stop_event)
 
-    def command_reading(self, input_queue: Queue, stop_event):
-        while not stop_event.is_set():
-            # Read command from the command line
-            try:
-                command = input_queue.get_nowait()
-                if len(command.strip()) != 0:
-                    if command == "view":
-                        last_valid_block = self.wallet.blockchain.chain[-1]
-                        last_block_transactions = last_valid_block.transactions
-                        last_validator_by_key = last_valid_block.validator
-                        print("Last validated block's transactions:")
-                        for transaction in last_block_transactions:
-                            print(transaction.payload())
+    def handle_command(self, command):
+        """Runs a command of the CLI (on the scheduler thread)"""
+        if len(command.strip()) != 0:
+            if command == "view":
+                last_valid_block = self.wallet.blockchain.chain[-1]
+                last_block_transactions = last_valid_block.transactions
+                last_validator_by_key = last_valid_block.validator
+                print("Last validated block's transactions:")
+                for transaction in last_block_transactions:
+                    print(transaction.payload())
 
-                        for last_validator_id, data in self.wallet.peers.items():
-                            if data["public_key"] == last_validator_by_key:
-                                print("With validator (by id): ", last_validator_id)
-                    elif command == "view_chain":
-                        for block in self.wallet.blockchain.chain:
-                            print("Block index: ", block.index)
-                            print("Block validator: ", block.validator)
-                            print("Block previous hash: ", block.previous_hash)
-                            print("Block hash: ", block.current_hash)
-                            print("Block transactions: ")
-                            for transaction in block.transactions:
-                                print(transaction.payload())
-                            print("\n")
-                    elif command == "balance":
-                        balance = self.wallet.my_balance()
-                        print("Balance, validated stake: ", balance, " BCCs")
+                last_validator_id = self.wallet.address_book.id_of(last_validator_by_key)
+                if last_validator_id is not None:
+                    print("With validator (by id): ", last_validator_id)
+            elif command == "view_chain":
+                for block in self.wallet.blockchain.chain:
+                    print("Block index: ", block.index)
+                    print("Block validator: ", block.validator)
+                    print("Block previous hash: ", block.previous_hash)
+                    print("Block hash: ", block.current_hash)
+                    print("Block transactions: ")
+                    for transaction in block.transactions:
+                        print(transaction.payload())
+                    print("\n")
+            elif command == "balance":
+                balance = self.wallet.my_balance()
+                print("Balance, validated stake: ", balance, " BCCs")
 
-                    elif command == "help":
-                        print("Acceptable commands:")
-                        print("t <number>: Perform a transaction with the specified amount")
-                        print("m <text>: Send a message with the provided text")
-                        print("stake <number>: Stake the specified amount")
-                        print("view: View the last validated block's transactions and validator")
-                        print("balance: View your current balance (up to the last validated block)")
-                    else:
-                        arguments = process_command(command)
-                        arguments = json.loads(arguments)
+            elif command == "stats":
+                print("Inbound messages: ", self.p2p.dispatcher.stats())
+                print("Signature verification: ", self.p2p.verifier.stats())
+                print("Chain synchronisation: ", self.p2p.synchronizer.stats())
+                print("Compact blocks: ", self.p2p.relay.stats())
+                print("Outbound queues: ", self.p2p.outbound.stats())
+                if self.p2p.compression.codec is not None:
+                    print("Compression: ", self.p2p.compression.stats())
+                if self.wallet.batcher is not None:
+                    print("Transaction batches: ", self.wallet.batcher.stats())
+                if self.p2p.gossip is not None:
+                    print("Gossip: ", self.p2p.gossip.stats())
+                    print("Transaction repair: ", self.p2p.repair.stats())
+                print("Block scheduling: ", self.scheduler.stats())
 
-                        # Given the user id find its public key from your dictionary
-                        if arguments["type"] != "Stake":
-                            receiver_address = self.p2p.peers[arguments["receiver"]]["public_key"]
-                        else:
-                            receiver_address = 0
+            elif command == "help":
+                print("Acceptable commands:")
+                print("t <number>: Perform a transaction with the specified amount")
+                print("m <text>: Send a message with the provided text")
+                print("stake <number>: Stake the specified amount")
+                print("view: View the last validated block's transactions and validator")
+                print("balance: View your current balance (up to the last validated block)")
+                print("stats: View the inbound and outbound message queues, signature verification, chain synchronisation and block scheduling")
+            else:
+                arguments = process_command(command)
+                if arguments is None:
+                    return
+                arguments = json.loads(arguments)
 
-                        transaction_to_send = self.wallet.create_transaction(
-                                                        receiver_address,
-                                                        arguments["type"], 
-                                                        arguments.get("amount", 0),  # Use default value if "amount" key is not present
-                                                        arguments.get("message", "")  # Use default value if "data" key is not present
-                                                    )
-                    
-                        if self.wallet.check_transaction(transaction_to_send) is not None:
-                            self.wallet.broadcast_transaction(transaction_to_send)
-
-                        if self.wallet.transaction_pool.validation_required() and not self.wallet.await_block:
-                            block = self.wallet.mint_block()
-                            if block is not None:
-                                self.wallet.broadcast_block(block)
-            except Exception:
-                pass
+                # Given the user id find its public key from your dictionary
+                if arguments["type"] != "Stake":
+                    receiver_address = self.wallet.address_book.public_key_of(arguments["receiver"])
+                    if receiver_address is None:
+                        print(f"Unknown peer {arguments['receiver']}")
+                        return
+                else:
+                    receiver_address = 0
 
-        print(len(self.wallet.transaction_pool.transactions))
-        while self.wallet.transaction_pool.validation_required():
-            if not self.wallet.await_block:
-                block = self.wallet.mint_block()
-                if block is not None:
-                    self.wallet.broadcast_block(block)
+                transaction_to_send = self.wallet.create_transaction(
+                                                receiver_address,
+                                                arguments["type"], 
+                                                arguments.get("amount", 0),  # Use default value if "amount" key is not present
+                                                arguments.get("message", "")  # Use default value if "data" key is not present
+                                            )
                     
-        self.p2p.disconnect_sockets()
-            
-        print(len(self.wallet.transaction_pool.transactions))
+                # The scheduler mints a block after the command if the pool is full
+                if self.wallet.check_transaction(transaction_to_send) is not None:
+                    self.wallet.broadcast_transaction(transaction_to_send)
 
     def blockchaining(self, stop_event):
+        # Blocks are minted only by the scheduler, which runs on this thread
+        self.scheduler = Scheduler(self.wallet, self.handle_command)
+        self.wallet.set_scheduler(self.scheduler)
 
-        if self.p2p.id == 'id0':
+        if self.p2p.id == 'id0' and not self.restarted:
             self.wallet.initial_distribution()
 
-        # Create queues for each thread to handle its input
-        input_queue = Queue()
-
-        # Start a separate thread to read input and dispatch to appropriate threads
-        input_thread = threading.Thread(target=read_input, args=(input_queue, stop_event, self.p2p.id))
+        # Start a separate thread to read input and hand the commands to the scheduler
+        input_thread = threading.Thread(target=read_input, args=(self.scheduler.events, stop_event, self.p2p.id))
         input_thread.daemon = True
         input_thread.start()
 
-        self.command_reading(input_queue, stop_event)
\ No newline at end of file
+        self.scheduler.run(stop_event)
+
+        print(len(self.wallet.transaction_pool.transactions))
+        self.p2p.disconnect_sockets()
\ No newline at end of file
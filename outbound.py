@@ -0,0 +1,194 @@
+"""For sending to peers without blocking - every peer has its own outbound queue drained by a writer thread"""
+
+import socket
+import threading
+from collections import deque
+
+MAX_FRAMES = 10000  # Frames queued for one peer at most
+MAX_BYTES = 64 * 1024 * 1024  # Bytes queued for one peer at most
+WRITE_SIZE = 256 * 1024  # Small frames are joined into writes of up to this many bytes
+POLICIES = ("drop", "disconnect")  # What happens to frames for a peer whose queue is full
+
+
+class PeerSender:
+    """The outbound queue of one peer and the thread that writes it to the peer's socket"""
+
+    def __init__(self, peer_id, peer_socket, policy, max_frames=MAX_FRAMES, max_bytes=MAX_BYTES, codec=None):
+        self.peer_id = peer_id
+        self.socket = peer_socket
+        self.policy = policy
+        self.codec = codec  # Compression agreed on with the peer (None: frames are sent as they are)
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.condition = threading.Condition()
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.writing = False  # A write is in progress
+        self.closed = False
+        self.disconnected = False  # Nothing more is sent to the peer (it fell too far behind)
+        self.sent = 0
+        self.sent_bytes = 0
+        self.writes = 0  # Socket writes (frames are joined into as few as possible)
+        self.dropped = 0
+        self.max_backlog = 0
+
+        t = threading.Thread(target=self.write)
+        t.daemon = True
+        t.start()
+
+    def put(self, frame):
+        """Queues a frame - never blocks. Returns False if it was dropped."""
+        with self.condition:
+            if self.closed or self.disconnected:
+                self.dropped += 1
+                return False
+            if len(self.queue) >= self.max_frames or self.queued_bytes + len(frame) > self.max_bytes:
+                self.dropped += 1
+                if self.policy == "disconnect":
+                    print(f"Disconnecting from slow peer {self.peer_id} ({len(self.queue)} frames queued)")
+                    self.disconnect()
+                return False
+            self.queue.append(frame)
+            self.queued_bytes += len(frame)
+            self.max_backlog = max(self.max_backlog, len(self.queue))
+            self.condition.notify_all()
+            return True
+
+    def write(self):
+        """Writer loop - sends the queued frames in order, joining small ones into one write"""
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.closed)
+                if self.closed:
+                    return
+                frames = [self.queue.popleft()]
+                size = len(frames[0])
+                while self.queue and size + len(self.queue[0]) <= WRITE_SIZE:
+                    frames.append(self.queue.popleft())
+                    size += len(frames[-1])
+                self.queued_bytes -= size
+                self.writing = True
+            try:
+                self.socket.sendall(b"".join(frames) if len(frames) > 1 else frames[0])
+            except OSError as e:
+                print(f"Error sending to peer {self.peer_id}: {e}")
+                with self.condition:
+                    self.dropped += len(frames)
+                    self.close()
+                return
+            with self.condition:
+                self.writing = False
+                self.sent += len(frames)
+                self.sent_bytes += size
+                self.writes += 1
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until everything queued was written - returns False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.closed or not (self.queue or self.writing), timeout)
+
+    def disconnect(self):
+        """
+        Stops sending to the peer: the queued frames and every later one are dropped (and counted).
+        The socket is left open - the peer takes its connection closing for the cluster shutting down.
+        """
+        with self.condition:
+            self.disconnected = True
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.queued_bytes = 0
+            self.condition.notify_all()
+
+    def close(self):
+        """Stops the writer and closes the connection (frames still queued are dropped)"""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.queued_bytes = 0
+            self.condition.notify_all()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+            self.socket.close()
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.condition:
+            return {
+                "queued": len(self.queue),
+                "queued_bytes": self.queued_bytes,
+                "max_backlog": self.max_backlog,
+                "sent": self.sent,
+                "sent_bytes": self.sent_bytes,
+                "writes": self.writes,
+                "dropped": self.dropped,
+                "connected": not (self.closed or self.disconnected),
+            }
+
+
+class Outbound:
+    """
+    The outbound queues of all peers. Sending and broadcasting only queue frames, so a slow or stalled peer
+    never holds up the sender (or whoever waits for the sender's locks); when a peer's queue is full its
+    frames are dropped, or nothing more is sent to the peer at all, depending on the policy.
+    """
+
+    def __init__(self, policy="drop", max_frames=MAX_FRAMES, max_bytes=MAX_BYTES, compression=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow peer policy {policy}")
+        self.policy = policy
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.compression = compression  # Compresses the frames of peers that agreed on a codec
+        self.senders = {}  # Mapping of peer id to its PeerSender
+
+    def add(self, peer_id, peer_socket, codec=None):
+        self.senders[peer_id] = PeerSender(
+            peer_id, peer_socket, self.policy, self.max_frames, self.max_bytes, codec
+        )
+
+    def encoded(self, codec, frame):
+        """The frame to send to a peer using codec"""
+        if codec is None or self.compression is None:
+            return frame
+        return self.compression.compress(codec, frame)
+
+    def __iter__(self):
+        """The ids of the peers that are still connected"""
+        return iter([peer_id for peer_id, sender in list(self.senders.items()) if not sender.closed])
+
+    def send(self, peer_id, frame):
+        """Queues an encoded frame for one peer"""
+        sender = self.senders.get(peer_id)
+        return sender is not None and sender.put(self.encoded(sender.codec, frame))
+
+    def broadcast(self, frame):
+        """Queues an encoded frame for every peer (compressed once for all the peers using the same codec)"""
+        frames = {}  # Mapping of codec to the frame sent with it
+        for sender in list(self.senders.values()):
+            if sender.codec not in frames:
+                frames[sender.codec] = self.encoded(sender.codec, frame)
+            sender.put(frames[sender.codec])
+
+    def flush(self, timeout=None):
+        """Waits until every queue was written (each waits at most timeout seconds)"""
+        return all([sender.flush(timeout) for sender in list(self.senders.values())])
+
+    def close(self):
+        for sender in list(self.senders.values()):
+            sender.close()
+
+    def stats(self):
+        """Returns the backlog and counters of every peer, and the totals"""
+        peers = {peer_id: sender.stats() for peer_id, sender in list(self.senders.items())}
+        return {
+            "policy": self.policy,
+            "queued": sum(peer["queued"] for peer in peers.values()),
+            "dropped": sum(peer["dropped"] for peer in peers.values()),
+            "sent_bytes": sum(peer["sent_bytes"] for peer in peers.values()),
+            "peers": peers,
+        }
@@ -1,12 +1,28 @@
-import pickle
 import threading
 import time
 import socket
 import json
-import jsonpickle
-from config import N
-from utils import BlockChainUtils
+from concurrent.futures import ThreadPoolExecutor
+from config import N, STAKE, GOSSIP_FANOUT, SLOW_PEER_POLICY, COMPRESSION, COMPRESSION_THRESHOLD, VERIFIER_PROCESSES
+from codec import Codec
 from blockchain import Blockchain
+from framing import FrameDecoder, encode_frame, send_frame
+from dispatcher import Dispatcher
+from verifier import BatchVerifier
+from message import Message
+from transaction import Transaction
+from sync import Synchronizer
+from gossip import Gossip, TransactionRepair, default_fanout
+from outbound import Outbound
+from batching import VerifiedBatch
+from compact import CompactRelay
+from compression import Compression
+
+BACKOFF_START = 0.05  # Seconds before the first redial of a peer that is not listening yet (doubles every time)
+BACKOFF_MAX = 2.0  # Longest wait between two dials
+DIAL_TIMEOUT = 30.0  # Seconds a peer is dialled for before giving up on it
+MESH_TIMEOUT = 60.0  # Seconds to wait for every peer to report its connections ready
+MESH_ATTEMPTS = 3  # Rounds of dialling the peers still missing before the node gives up starting
 
 # from Wallet import Wallet
 
@@ -18,9 +34,27 @@ class P2P:
         self.public_key = wallet.public_key
         self.peers = None     # Dictionary of peers' id: {'ip': ip, 'port': port, 'public_key': public_key, 'balance': balance, 'stake': stake}
         self.nodes = {}       # Dictionary of nodes' id: sending_socket}
+        self.compression = Compression(COMPRESSION, COMPRESSION_THRESHOLD)  # Of large messages, if peers agree
+        self.outbound = Outbound(SLOW_PEER_POLICY, compression=self.compression)  # Frames to send to every node
+        self.inbound_codecs = {}  # Mapping of peer id to the compression agreed on for what it sends us
         self.bootstrap_node = ("127.0.0.1", 40000)
         self.cluster_size = N
         self.wallet = wallet
+        self.dispatcher = Dispatcher(self.message_handler)  # Hands received messages to the wallet
+        # Checks received signatures on a pool of processes, with the dispatcher's policy when it falls behind
+        self.verifier = BatchVerifier(
+            self.transaction_verified, processes=VERIFIER_PROCESSES, drop_timeout=self.dispatcher.drop_timeout
+        )
+        self.synchronizer = Synchronizer(wallet, self.send_to)  # Catches up with peers that are ahead
+        # Rebuilds compact blocks (waiting for the transactions the verifier still holds)
+        self.relay = CompactRelay(wallet, self.send_to, self.synchronizer, self.verifier.verifying)
+        self.ready = threading.Event()  # Set once the wallet has its peers and blockchain
+        self.mesh = threading.Condition()
+        self.ready_peers = set()  # Peers connected to every node (their READY arrived)
+        self.dial_retries = 0
+        self.mesh_time = None  # Seconds it took to form the mesh
+        self.gossip = None  # Gossip overlay (None: every message is sent to all peers)
+        self.repair = None  # Fills in the transactions gossip did not bring us (only with gossip)
 
         self.listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)        
@@ -28,83 +62,278 @@ class P2P:
 
     def set_wallet(self, wallet):
         self.wallet = wallet
+        self.synchronizer.wallet = wallet
+        self.relay.wallet = wallet
+        wallet.set_gossip(self.gossip)
+        if self.gossip is not None:
+            self.repair = TransactionRepair(wallet, self.outbound, self.send_to)
+        self.ready.set()
+
+    def send_to(self, peer_id, message):
+        """Queues a message for one peer"""
+        self.outbound.send(peer_id, encode_frame(Codec.encode(message)))
+
+    def send_encoded(self, peer_id, frame):
+        """Queues an already framed message for one peer"""
+        self.outbound.send(peer_id, frame)
+
+    def announce_status(self):
+        """Tells every peer our height and tip hash (they catch up from us if they are behind)"""
+        for peer_id in list(self.nodes):
+            self.send_to(peer_id, self.synchronizer.status())
 
     def start_listening(self, stop_event):
-        self.listening_socket.listen(10)
+        self.listening_socket.listen(max(10, self.cluster_size))  # Every peer dials in at about the same time
         while not stop_event.is_set():
             peer_listening_socket, client_address = self.listening_socket.accept()
-            data = peer_listening_socket.recv(1024).decode()
-            peer_id = json.loads(data)
-            t = threading.Thread(target=self.handle_connection, args=(peer_listening_socket, peer_id, stop_event,))
+            t = threading.Thread(target=self.handle_connection, args=(peer_listening_socket, stop_event,))
             t.daemon = True
             t.start()
 
-    def handle_connection(self, peer_socket, peer_id, stop_event):
+    def handle_connection(self, peer_socket, stop_event):
+        peer_id = None
         try:
+            decoder = FrameDecoder()
+            # The first frame of every connection is the id of the connecting peer and the compression it offers
+            peer_id = self.accept_hello(decoder.next_frame(peer_socket))
+            send_frame(peer_socket, json.dumps(self.inbound_codecs[peer_id]).encode())
             while not stop_event.is_set():
-                # Receive data from the client
-                data = peer_socket.recv(409600)
-                # Unpickle the received data
-                message = pickle.loads(data)
-
-                t = threading.Thread(target=self.message_handler, args=(message,))
-                t.daemon = True
-                t.start()
-                # Receive data from the client
-                data = peer_socket.recv(409600)
-                # Unpickle the received data
-                message = pickle.loads(data)
-                if message:
-                    decoded_message = BlockChainUtils.decode(message)
-                    if decoded_message.message_type == "TRANSACTION":
-                        self.wallet.handle_transaction(decoded_message.data)
-                    elif decoded_message.message_type == "BLOCK":
-                        self.wallet.handle_block(decoded_message.data)
-                    else:
-                        self.wallet.handle_blockchain(decoded_message.data)
+                # Receive every complete frame the client has sent so far
+                for frame in decoder.receive(peer_socket):
+                    routed = self.route(peer_id, frame)
+                    if routed is not None:
+                        # Blocks while the worker of this peer is full
+                        self.dispatcher.dispatch(*routed)
         except EOFError:
             # Shutdown and close the socket when done
             peer_socket.shutdown(socket.SHUT_RDWR)
             peer_socket.close()
             stop_event.set()  # Set the stop event to signal the node that nodes are starting to close
+        except ValueError as e:
+            # An oversized frame (or a broken hello) - only this connection is dropped, the node keeps running
+            print(f"Dropping the connection from peer {peer_id}: {e}")
+            peer_socket.close()
+
+    def hello(self):
+        """The first frame sent on a connection we dial"""
+        return json.dumps({"id": self.id, "compression": self.compression.offer()}).encode()
+
+    def accept_hello(self, frame):
+        """Reads the first frame of a connection from a peer and picks its compression - returns the peer id"""
+        hello = json.loads(frame.decode())
+        self.inbound_codecs[hello["id"]] = self.compression.choose(hello["compression"])
+        return hello["id"]
+
+    def route(self, peer_id, frame):
+        """
+        Decodes a frame received from peer_id and handles it up to the wallet. Returns (sender id, message)
+        if it is for the dispatcher, None if there is nothing left to do.
+        """
+        try:
+            message = Codec.decode(self.compression.decompress(self.inbound_codecs.get(peer_id), frame))
+            if not isinstance(message, Message):
+                raise ValueError(f"Expected a message, got {type(message).__name__}")
+            return self.route_message(peer_id, message)
+        except (ValueError, TypeError, AttributeError, IndexError, KeyError) as e:
+            # A peer's malformed frame costs us that frame only - never the connection or the node
+            print(f"Dropping malformed message from {peer_id}: {e}")
+            return None
+
+    def route_message(self, peer_id, message):
+        sender_id = peer_id
+        if message.message_type == "GOSSIP":
+            if self.gossip is None:
+                return None
+            sender_id = message.data[1]  # The origin - keeps the order of its messages
+            message = self.gossip.receive(peer_id, message.data)
+            if message is None:
+                return None  # Seen before
+        if message.message_type == "READY":
+            # Handled here - the wallet is not set up before the mesh is
+            self.peer_ready(message.data)
+        elif message.message_type == "TRANSACTION":
+            # Reaches the dispatcher once its signature is checked (dropped if the verifier stays full)
+            if not isinstance(message.data, Transaction):
+                raise ValueError("TRANSACTION without a transaction")
+            self.verifier.submit(message.data, sender_id)
+        elif message.message_type == "TRANSACTION_BATCH":
+            # Reaches the dispatcher as a whole once every signature is checked
+            if not isinstance(message.data, list) or not all(isinstance(t, Transaction) for t in message.data):
+                raise ValueError("TRANSACTION_BATCH without a list of transactions")
+            if message.data:
+                batch = VerifiedBatch(sender_id, len(message.data))
+                for transaction in message.data:
+                    if not self.verifier.submit(transaction, batch):
+                        # Counted as not valid, so the rest of the batch is still delivered
+                        self.transaction_verified(transaction, False, batch)
+        else:
+            return sender_id, message
+        return None
+
+    def transaction_verified(self, transaction, signature_valid, context):
+        # Called by the verifier in the order the transactions were received
+        # (context is the sender id, or the VerifiedBatch the transaction came in)
+        if isinstance(context, VerifiedBatch):
+            if context.add(transaction, signature_valid):
+                if not self.dispatcher.dispatch(context.sender_id, Message("VERIFIED_BATCH", context.results)):
+                    self.verifier.done([transaction for transaction, _ in context.results])
+            return
+        if not self.dispatcher.dispatch(context, Message("VERIFIED_TRANSACTION", (transaction, signature_valid))):
+            self.verifier.done([transaction])
+
+    def message_handler(self, sender_id, decoded_message):
+        # Peers may send before our wallet is set up (they finish bootstrapping at different times)
+        self.ready.wait()
+        if decoded_message.message_type == "VERIFIED_TRANSACTION":
+            transaction, signature_valid = decoded_message.data
+            try:
+                self.wallet.handle_transaction(transaction, signature_valid=signature_valid)
+            finally:
+                self.transactions_handled([transaction])
+        elif decoded_message.message_type == "VERIFIED_BATCH":
+            try:
+                self.wallet.handle_transactions(decoded_message.data)
+            finally:
+                self.transactions_handled([transaction for transaction, _ in decoded_message.data])
+        elif decoded_message.message_type == "TRANSACTION":
+            self.wallet.handle_transaction(decoded_message.data)
+        elif decoded_message.message_type == "BLOCK":
+            self.receive_block(decoded_message.data)
+        elif decoded_message.message_type == "COMPACT_BLOCK":
+            block = self.relay.handle_compact_block(sender_id, *decoded_message.data)
+            if block is not None:
+                self.receive_block(block)
+        elif decoded_message.message_type == "GET_BLOCK_TRANSACTIONS":
+            self.relay.handle_get_block_transactions(sender_id, *decoded_message.data)
+        elif decoded_message.message_type == "BLOCK_TRANSACTIONS":
+            block = self.relay.handle_block_transactions(sender_id, *decoded_message.data)
+            if block is not None:
+                self.receive_block(block)
+        elif decoded_message.message_type == "POOL_IDS":
+            if self.repair is not None:
+                self.repair.handle_pool_ids(sender_id, decoded_message.data)
+        elif decoded_message.message_type == "GET_TRANSACTIONS":
+            if self.repair is not None:
+                self.repair.handle_get_transactions(sender_id, decoded_message.data)
+        elif decoded_message.message_type == "STATUS":
+            self.synchronizer.handle_status(sender_id, *decoded_message.data)
+        elif decoded_message.message_type == "GET_HEADERS":
+            self.synchronizer.handle_get_headers(sender_id, *decoded_message.data)
+        elif decoded_message.message_type == "HEADERS":
+            self.synchronizer.handle_headers(sender_id, *decoded_message.data)
+        elif decoded_message.message_type == "GET_BLOCKS":
+            self.synchronizer.handle_get_blocks(sender_id, *decoded_message.data)
+        elif decoded_message.message_type == "BLOCKS":
+            self.synchronizer.handle_blocks(sender_id, *decoded_message.data)
+        elif decoded_message.message_type == "BLOCKCHAIN":
+            self.wallet.handle_blockchain(decoded_message.data)
+        else:
+            print(f"Dropping {decoded_message.message_type} message from {sender_id}: unknown type")
+
+    def transactions_handled(self, transactions):
+        """Received transactions reached the wallet - the compact blocks waiting for them may be complete now"""
+        self.verifier.done(transactions)
+        if self.repair is not None:
+            self.repair.transactions_handled(transactions)
+        for block in self.relay.transactions_arrived():
+            self.receive_block(block)
+
+    def receive_block(self, block):
+        if block.index > self.wallet.blockchain.next_index():
+            # We missed blocks - catch up from the validator of this one
+            validator_id = self.wallet.address_book.id_of(block.validator)
+            if validator_id is not None:
+                self.synchronizer.handle_status(validator_id, block.index, block.current_hash)
+        else:
+            self.wallet.handle_block(block)
+
+    def dial(self, peer_id, peer_info):
+        """
+        Connects to a peer, dialling again with exponential backoff while it is not listening yet.
+        Returns the number of attempts.
+        """
+        peer_ip = peer_info['ip']
+        peer_port = peer_info['port']
+        deadline = time.time() + DIAL_TIMEOUT
+        delay = BACKOFF_START
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                peer_send_socket = socket.create_connection((peer_ip, peer_port))
+                send_frame(peer_send_socket, self.hello())
+                # The peer answers with the compression it accepts for this connection
+                codec = json.loads(FrameDecoder().next_frame(peer_send_socket).decode())
+                self.nodes[peer_id] = peer_send_socket
+                self.outbound.add(peer_id, peer_send_socket, codec)
+                print(f"Successfully connected to peer {peer_id}.")
+                return attempts
+            except (OSError, EOFError, ValueError) as e:
+                if time.time() + delay > deadline:
+                    print(f"Could not connect to peer {peer_id} at {peer_ip}:{peer_port}: {e}")
+                    return attempts
+                time.sleep(delay)
+                delay = min(delay * 2, BACKOFF_MAX)
 
-    def message_handler(self, message):
-        if message:
-            decoded_message = BlockChainUtils.decode(message)
-            if decoded_message.message_type == "TRANSACTION":
-                self.wallet.handle_transaction(decoded_message.data)
-            elif decoded_message.message_type == "BLOCK":
-                self.wallet.handle_block(decoded_message.data)
-            else:
-                self.wallet.handle_blockchain(decoded_message.data)
-            
     def connect_to_all_peers(self):
-        for peer_id, peer_info in self.peers.items():
-            if peer_id != self.id:
-                peer_ip = peer_info['ip']
-                peer_port = peer_info['port']
-                print(f"Attempting to connect to peer {peer_id} at {peer_ip}:{peer_port}...")
-                try:
-                    peer_send_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    peer_send_socket.connect((peer_ip, peer_port))
-                    peer_send_socket.send(json.dumps(self.id).encode())
-                    self.nodes[peer_id] = peer_send_socket
-                    print(f"Successfully connected to peer {peer_id}.")
-                except ConnectionRefusedError:
-                    print(f"Connection to peer {peer_id} at {peer_ip}:{peer_port} refused.")
-                except Exception as e:
-                    print(f"Error connecting to peer {peer_id}: {e}")
+        """Dials all peers we are not connected to yet at the same time - returns True once we are connected to all"""
+        others = [
+            (peer_id, peer_info) for peer_id, peer_info in self.peers.items()
+            if peer_id != self.id and peer_id not in self.nodes
+        ]
+        with ThreadPoolExecutor(max_workers=min(64, max(1, len(others)))) as executor:
+            attempts = list(executor.map(lambda peer: self.dial(*peer), others))
+        self.dial_retries += sum(attempts) - len(attempts)
+        return all(peer_id in self.nodes for peer_id in self.peers if peer_id != self.id)
+
+    def start_gossip(self):
+        """Sets up the gossip overlay if the cluster uses one (before any peer can send to us)"""
+        if GOSSIP_FANOUT is not None:
+            fanout = GOSSIP_FANOUT or default_fanout(self.cluster_size)
+            self.gossip = Gossip(self.id, self.outbound, fanout, self.send_encoded)
+
+    def peer_ready(self, peer_id):
+        with self.mesh:
+            self.ready_peers.add(peer_id)
+            self.mesh.notify_all()
+
+    def form_mesh(self):
+        """
+        Connects to every peer, then waits at a barrier: every node sends READY to all peers once all its
+        connections are up, so when READY arrived from every peer the whole mesh is complete and all nodes know it.
+        The peers still missing are dialled again, up to MESH_ATTEMPTS times - the node never runs on a partial
+        mesh (ConnectionError). Returns True once the mesh is complete.
+        """
+        start = time.perf_counter()
+        self.dial_retries = 0
+        for attempt in range(1, MESH_ATTEMPTS + 1):
+            connected = self.connect_to_all_peers()
+            complete = False
+            if connected:
+                # Sent every round: it only reaches the peers we are connected to when it is sent
+                self.outbound.broadcast(encode_frame(Codec.encode(Message("READY", self.id))))
+                with self.mesh:
+                    complete = self.mesh.wait_for(lambda: len(self.ready_peers) == len(self.peers) - 1, MESH_TIMEOUT)
+            if complete:
+                break
+            missing = sorted(set(self.peers) - self.ready_peers - {self.id})
+            not_connected = sorted(
+                peer_id for peer_id in self.peers if peer_id != self.id and peer_id not in self.nodes
+            )
+            print(f"Mesh incomplete after {time.perf_counter() - start:.3f} seconds (attempt {attempt} of "
+                  f"{MESH_ATTEMPTS}) - not ready: {missing}, not connected: {not_connected}")
+        else:
+            raise ConnectionError(f"Mesh incomplete after {MESH_ATTEMPTS} attempts - not ready: {missing}")
+        self.mesh_time = time.perf_counter() - start
+        print(f"Mesh of {len(self.peers)} nodes ready in {self.mesh_time:.3f} seconds "
+              f"({self.dial_retries} redials)")
+        return True
 
 
     def connect_to_bootstrap_node(self, bootstrap_ip, bootstrap_port):
         bootstrap_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         bootstrap_socket.connect((bootstrap_ip, bootstrap_port))
-
-        # Receive my ID and Blockchain-so-far (only Genesis Block)
-        id_blockchain_json = bootstrap_socket.recv(4096).decode()
-        id_blockchain = json.loads(id_blockchain_json)
-        self.id = id_blockchain['id']
-        self.blockchain = jsonpickle.decode(id_blockchain['blockchain'])
+        decoder = FrameDecoder()
 
         # Send my info: ip, port and public key
         ip_port_pubkey = {
@@ -112,85 +341,135 @@ class P2P:
             'port': self.port,
             'public_key': self.public_key
         }
-        bootstrap_socket.send(json.dumps(ip_port_pubkey).encode())
+        send_frame(bootstrap_socket, json.dumps(ip_port_pubkey).encode())
 
-        # Receive peers' infos
-        peers_info_json = bootstrap_socket.recv(40960).decode()
+        # Receive my ID and Blockchain-so-far (only Genesis Block)
+        self.id, self.blockchain = Codec.decode(decoder.next_frame(bootstrap_socket)).data
+
+        # Receive peers' infos (once every node has joined)
         # Update self.peers (id, ip, port and public_key)
-        self.peers = json.loads(peers_info_json)
+        self.peers = json.loads(decoder.next_frame(bootstrap_socket).decode())
 
         bootstrap_socket.close()
 
+    def handle_join(self, join_socket, client_address, joined):
+        """
+        Handshake with one joining node (runs in its own thread): gets its info, then gives it the next free ID
+        and the blockchain. The ID is only taken once the info arrived, so a failed join leaves no gap.
+        """
+        try:
+            ip_port_pubkey = json.loads(FrameDecoder().next_frame(join_socket).decode())
+            with self.join_lock:
+                if len(self.peers) >= self.cluster_size:
+                    raise ConnectionError("the cluster is full")
+                id = "id" + str(len(self.peers))
+                # Sent while holding the lock (the genesis chain is a small frame): the ID is only recorded
+                # once it was delivered, and the peer table can never overtake it
+                send_frame(join_socket, Codec.encode(Message("JOIN", (id, self.blockchain))))
+                self.peers[id] = {
+                    'ip': ip_port_pubkey['ip'],
+                    'port': ip_port_pubkey['port'],
+                    'public_key': ip_port_pubkey['public_key'],
+                    'balance': 0,
+                    'stake': STAKE
+                }
+                joined.append((id, join_socket))
+                if len(self.peers) == self.cluster_size:
+                    self.all_joined.set()
+        except (EOFError, OSError, ValueError, KeyError) as e:
+            print(f"Join from {client_address} failed: {e}")
+            join_socket.close()
 
     def bootstrap_mode(self):
-        self.listening_socket.listen()
-        i = 1
-        temp_sockets = []
-
-        while i < self.cluster_size:
-            id = "id" + str(i)
-            temp_socket, client_address = self.listening_socket.accept()
+        """
+        Lets the other N-1 nodes join concurrently (one handshake thread each), then sends every one of them
+        the peer table in parallel. Returns the seconds from the first connection to a ready cluster.
+        """
+        self.listening_socket.listen(self.cluster_size)
+        self.join_lock = threading.Lock()
+        self.all_joined = threading.Event()
+        joined = []  # (ID, socket) of the nodes that got an ID
+        start = None
 
-            id_blockchain = {
-                'id': id,
-                'blockchain': jsonpickle.encode(self.blockchain)
-            }
-
-            temp_socket.send(json.dumps(id_blockchain).encode())
+        # Accept with a timeout so the loop notices when everybody has joined
+        self.listening_socket.settimeout(0.01)
+        while not self.all_joined.is_set():
+            try:
+                join_socket, client_address = self.listening_socket.accept()
+            except socket.timeout:
+                continue
+            join_socket.settimeout(None)
+            if start is None:
+                start = time.perf_counter()
+            t = threading.Thread(target=self.handle_join, args=(join_socket, client_address, joined,))
+            t.daemon = True
+            t.start()
+        self.listening_socket.settimeout(None)
 
-            ip_port_pubkey_json = temp_socket.recv(1024).decode()
-            ip_port_pubkey = json.loads(ip_port_pubkey_json)
-            ip = ip_port_pubkey['ip']
-            port = ip_port_pubkey['port']
-            public_key = ip_port_pubkey['public_key']
+        # Every joiner gets the same table - encoded once, sent to all of them at the same time
+        peers_frame = json.dumps(self.peers).encode()
+        def send_peers(joiner):
+            # A joiner that went away must not keep the table from the others - returns its ID if it failed
+            id, join_socket = joiner
+            try:
+                send_frame(join_socket, peers_frame)
+                return None
+            except OSError as e:
+                print(f"Sending the peer table to {id} failed: {e}")
+                return id
+            finally:
+                join_socket.close()
+        with ThreadPoolExecutor(max_workers=min(32, max(1, len(joined)))) as executor:
+            failed = [id for id in executor.map(send_peers, joined) if id is not None]
+        if failed:
+            print(f"{len(failed)} of {len(joined)} nodes did not get the peer table: {', '.join(failed)}")
 
-            self.peers[id] = {'ip': ip, 'port': port, 'public_key': public_key, 'balance': 0, 'stake': 10}
+        elapsed = time.perf_counter() - start if start is not None else 0.0
+        print(f"Bootstrapped {self.cluster_size} nodes in {elapsed:.3f} seconds")
+        return elapsed
 
-            temp_sockets.append(temp_socket)            
-            i += 1
 
-        for socket in temp_sockets:
-            socket.send(json.dumps(self.peers).encode())
+    def rejoin(self, identity):
+        """
+        Takes the ID and peer table a restarted node saved - no bootstrapping. The balances and stakes are
+        rebuilt from its snapshots and its blockchain is opened from its block store.
+        """
+        self.id = identity["id"]
+        self.peers = {
+            id: {'ip': peer['ip'], 'port': peer['port'], 'public_key': peer['public_key'], 'balance': 0, 'stake': STAKE}
+            for id, peer in identity["peers"].items()
+        }
+        self.blockchain = None
 
+    def p2p_network_init(self, stop_event, identity=None):
 
-    def p2p_network_init(self, stop_event):
+        # RESTARTED NODE (every node of the cluster is restarted on its data directory)
+        if identity is not None:
+            self.rejoin(identity)
 
         # BOOTSTRAP NODE
-        if ((self.ip, self.port) == self.bootstrap_node):
+        elif ((self.ip, self.port) == self.bootstrap_node):
             self.id = "id0"
-            self.peers = {self.id: {'ip': self.ip, 'port': self.port, 'public_key': self.public_key, 'balance': N*1000, 'stake': 10}}
+            self.peers = {self.id: {'ip': self.ip, 'port': self.port, 'public_key': self.public_key, 'balance': N*1000, 'stake': STAKE}}
             self.blockchain = Blockchain(self.wallet.public_key)
             self.bootstrap_mode()
-            t = threading.Thread(target=self.start_listening, args=(stop_event,))
-            t.daemon = True
-            t.start()
-            time.sleep(0.5)
-            self.connect_to_all_peers()
-            print("End of bootstrapping phase!")
-            print()
-            print("-----------------------------------------------------")
-            print()
 
         # NON-BOOTSTRAP NODES
         else:
             self.connect_to_bootstrap_node(self.bootstrap_node[0], self.bootstrap_node[1])
-            t = threading.Thread(target=self.start_listening, args=(stop_event,))
-            t.daemon = True
-            t.start()
-            time.sleep(0.5)
-            self.connect_to_all_peers()
-            print("End of bootstrapping phase!")
-            print()
-            print("-----------------------------------------------------")
-            print()
+
+        self.start_gossip()
+        t = threading.Thread(target=self.start_listening, args=(stop_event,))
+        t.daemon = True
+        t.start()
+        self.form_mesh()
+        print("End of bootstrapping phase!")
+        print()
+        print("-----------------------------------------------------")
+        print()
 
     def disconnect_sockets(self):
-        for s in self.nodes.values():
-            try:
-                # Step 1: Shutdown the socket
-                s.shutdown(socket.SHUT_RDWR)
-                # Step 2: Close the socket
-                s.close()
-            except Exception as e:
-                # Handle any exceptions gracefully
-                print(f"Error occurred while disconnecting socket: {e}")
+        # Let the writers send what is still queued first, then shut down and close every socket
+        if not self.outbound.flush(timeout=5):
+            print("Closing connections with messages still queued")
+        self.outbound.close()
@@ -1,4 +1,5 @@
 import random
+from bisect import bisect_right
 
 
 class ProofOfStake:
@@ -7,27 +8,38 @@ class ProofOfStake:
 
     def __init__(self):
         self.stakes = {}  # Mapping of account to stake
+        self.validators = []  # Accounts with a positive stake (sorted so every node agrees on the order)
+        self.cumulative_stakes = []  # Running total of the stakes of self.validators
+        self.total_stake = 0
 
     def set_stakes(self, stakes):
-        """Sets the stakes"""
-        self.stakes = stakes
+        """Sets the stakes (the cumulative table is only rebuilt if a stake changed)"""
+        if stakes == self.stakes:
+            return
+        self.stakes = dict(stakes)
+        self.build_cumulative_stakes()
 
-    def validator_lots(self):
-        """Creates list of all lots"""
-        lots = []
-        for validator, stake in self.stakes.items():
-            for _ in range(stake):
-                lots.append(validator)
-        return lots
+    def build_cumulative_stakes(self):
+        """Creates the sorted table of cumulative stakes"""
+        self.validators = sorted(
+            validator for validator, stake in self.stakes.items() if stake > 0
+        )
+        self.cumulative_stakes = []
+        total = 0
+        for validator in self.validators:
+            total += self.stakes[validator]
+            self.cumulative_stakes.append(total)
+        self.total_stake = total
 
-    def winner_lot(self, lots, seed):
-        """Finds which lot won"""
-        random.seed(seed)
-        winner_lot = random.choice(lots)
-        return winner_lot  # Returns winner_lot
+    def winner_lot(self, seed):
+        """Finds which lot won - a point in [0, total_stake) drawn from a generator seeded with seed"""
+        generator = random.Random(seed)  # Private generator, the shared module RNG is left untouched
+        return generator.random() * self.total_stake
 
     def validator(self, last_block_hash):
-        """Finds who will be the validator and returns their public key"""
-        lots = self.validator_lots()
-        winner_id = self.winner_lot(lots, last_block_hash)
-        return winner_id
+        """Finds who will be the validator and returns their id (None if nobody has staked)"""
+        if self.total_stake <= 0:
+            return None
+        lot = self.winner_lot(last_block_hash)
+        position = bisect_right(self.cumulative_stakes, lot)
+        return self.validators[min(position, len(self.validators) - 1)]
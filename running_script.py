@@ -1,15 +1,52 @@
-import sys
+import argparse
 import threading
 import config
 
 if __name__ == '__main__':
-    ip = sys.argv[1]
-    base_port = int(sys.argv[2])
-    N = int(sys.argv[3])
-    CAPACITY = int(sys.argv[4])
+    parser = argparse.ArgumentParser(description="Starts a node of the cluster")
+    parser.add_argument("ip")
+    parser.add_argument("port", type=int)
+    parser.add_argument("N", type=int, help="Number of nodes")
+    parser.add_argument("CAPACITY", type=int, help="Transactions per block")
+    parser.add_argument("--signature-scheme", default=config.SIGNATURE_SCHEME, choices=["rsa", "ed25519"],
+                        help="Scheme of the wallet keys (every node of the cluster should use the same)")
+    parser.add_argument("--data-dir", default=config.DATA_DIR,
+                        help="Keep the blockchain on disk under this directory (default: in memory only)")
+    parser.add_argument("--gossip-fanout", type=int, default=config.GOSSIP_FANOUT,
+                        help="Spread messages by gossip to this many random peers (0: ln(N) + 2; default: send to all)")
+    parser.add_argument("--slow-peer", default=config.SLOW_PEER_POLICY, choices=["drop", "disconnect"],
+                        help="What to do when a peer falls too far behind: drop the frames queued for it or send it nothing more")
+    parser.add_argument("--engine", default=config.NETWORK_ENGINE, choices=["threads", "asyncio"],
+                        help="Networking engine: a thread per connection, or one asyncio event loop")
+    parser.add_argument("--batch-window-ms", type=float, default=config.BATCH_WINDOW * 1000,
+                        help="Send the transactions broadcast within this many milliseconds as one message (default 0: off)")
+    parser.add_argument("--compression", default=config.COMPRESSION or "none", choices=["none", "zlib", "lzma"],
+                        help="Compress large messages to the peers that accept this codec (default: none)")
+    parser.add_argument("--compression-threshold", type=int, default=config.COMPRESSION_THRESHOLD,
+                        help="Messages of fewer bytes are sent uncompressed")
+    parser.add_argument("--verifier-processes", type=int, default=config.VERIFIER_PROCESSES,
+                        help="Processes verifying signatures (default: one per core; use 1 or 2 for many nodes on one machine)")
+    parser.add_argument("--compact-blocks", action="store_true", default=config.COMPACT_BLOCKS,
+                        help="Broadcast blocks as their header and transaction ids instead of with all their transactions")
+    args = parser.parse_args()
+
+    ip = args.ip
+    base_port = args.port
+    N = args.N
+    CAPACITY = args.CAPACITY
 
     config.N = N
     config.CAPACITY = CAPACITY
+    config.SIGNATURE_SCHEME = args.signature_scheme
+    config.DATA_DIR = args.data_dir
+    config.GOSSIP_FANOUT = args.gossip_fanout
+    config.SLOW_PEER_POLICY = args.slow_peer
+    config.NETWORK_ENGINE = args.engine
+    config.BATCH_WINDOW = args.batch_window_ms / 1000
+    config.COMPACT_BLOCKS = args.compact_blocks
+    config.COMPRESSION = None if args.compression == "none" else args.compression
+    config.COMPRESSION_THRESHOLD = args.compression_threshold
+    config.VERIFIER_PROCESSES = args.verifier_processes
     # Event to signal threads to exit
     stop_event = threading.Event()
 
@@ -0,0 +1,95 @@
+"""For deciding when a node mints a block - one thread that sleeps until something it waits for happens"""
+
+import queue
+import threading
+
+STOP_CHECK = 0.5  # Seconds between two checks of the stop event while nothing happens
+DRAIN_TIMEOUT = 30  # Seconds a stopping node waits for a block of another validator before giving up
+WAKE = object()  # Event: the pool grew or a block was committed
+
+
+class Scheduler:
+    """
+    Owns every mint_block call of a node. The CLI puts its commands in events, and the wallet calls
+    notify when transactions enter the pool or a block is committed (a burst of notifications wakes the
+    scheduler once). After every event the scheduler mints a block if the pool is full and we are not
+    waiting for another validator's block, so two threads never mint at the same time. It blocks on
+    events in between, so an idle node uses no CPU.
+    """
+
+    def __init__(self, wallet, handle_command):
+        self.wallet = wallet
+        self.handle_command = handle_command  # Called on the scheduler thread for every CLI command
+        self.events = queue.Queue()  # CLI commands (str) and WAKE
+        self.lock = threading.Lock()
+        self.woken = False  # A WAKE is queued and not handled yet
+        self.commands = 0
+        self.wakeups = 0
+        self.minted = 0
+        self.waited = 0  # Times the pool was full while another validator's block was awaited
+
+    def notify(self):
+        """The pool grew or a block was committed - the scheduler checks whether to mint"""
+        with self.lock:
+            if self.woken:
+                return
+            self.woken = True
+        self.events.put(WAKE)
+
+    def handle(self, event):
+        if event is WAKE:
+            with self.lock:
+                self.woken = False
+            self.wakeups += 1
+        else:
+            self.commands += 1
+            try:
+                self.handle_command(event)
+            except Exception as e:
+                print(f"Command failed: {e}")
+        self.mint_if_due()
+
+    def mint_if_due(self):
+        wallet = self.wallet
+        if not wallet.transaction_pool.validation_required():
+            return
+        if wallet.await_block:
+            self.waited += 1
+            return
+        block = wallet.mint_block()
+        if block is not None:
+            self.minted += 1
+            wallet.broadcast_block(block)
+            # The pool may hold enough transactions for the next block as well
+            self.notify()
+
+    def run(self, stop_event):
+        """Handles events until stop_event is set, then mints the blocks the pool still fills"""
+        while not stop_event.is_set():
+            try:
+                event = self.events.get(timeout=STOP_CHECK)
+            except queue.Empty:
+                continue
+            self.handle(event)
+        self.drain()
+
+    def drain(self):
+        """Keeps minting (or waiting for the blocks of the other validators) until the pool is not full"""
+        self.mint_if_due()
+        while self.wallet.transaction_pool.validation_required():
+            try:
+                event = self.events.get(timeout=DRAIN_TIMEOUT)
+            except queue.Empty:
+                print("No block arrived in time, stopping with a full pool")
+                return
+            if event is WAKE:
+                self.handle(event)  # Commands typed while stopping are ignored
+
+    def stats(self):
+        return {
+            "commands": self.commands,
+            "wakeups": self.wakeups,
+            "minted": self.minted,
+            "awaiting_block": self.waited,
+            "queued": self.events.qsize(),
+        }
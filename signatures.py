@@ -0,0 +1,122 @@
+"""Signature schemes a cluster can choose from (RSA by default) and a cache of parsed public keys"""
+
+import threading
+from collections import OrderedDict
+
+from Crypto.PublicKey import RSA, ECC    # pycryptodome
+from Crypto.Signature import pkcs1_15, eddsa
+from Crypto.Hash import SHA256
+
+KEY_CACHE_SIZE = 4096  # Parsed public keys kept in memory
+
+
+class KeyCache:
+    """Keeps the key objects of the most recently used PEM public keys, so each is parsed once"""
+
+    def __init__(self, size=KEY_CACHE_SIZE):
+        self.size = size
+        self.keys = OrderedDict()  # Mapping of PEM public key to key object, least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, public_key):
+        """Returns the key object of a PEM public key (raises ValueError if it cannot be parsed)"""
+        with self.lock:
+            key = self.keys.get(public_key)
+            if key is not None:
+                self.keys.move_to_end(public_key)
+                self.hits += 1
+                return key
+        key = import_public_key(public_key)
+        with self.lock:
+            self.misses += 1
+            self.keys[public_key] = key
+            if len(self.keys) > self.size:
+                self.keys.popitem(last=False)
+        return key
+
+
+def import_public_key(public_key):
+    """Parses a PEM public key of any supported scheme"""
+    try:
+        return RSA.import_key(public_key)
+    except (ValueError, IndexError, TypeError):
+        pass
+    try:
+        return ECC.import_key(public_key)
+    except (ValueError, IndexError, TypeError) as e:
+        raise ValueError(f"Unsupported public key: {e}")
+
+
+class RSAScheme:
+    """RSA-2048 with PKCS#1 v1.5 signatures over SHA-256"""
+
+    name = "rsa"
+
+    def generate(self):
+        """Returns a new (private key object, PEM private key, PEM public key)"""
+        key = RSA.generate(2048)
+        return key, key.export_key().decode('utf-8'), key.publickey().export_key().decode('utf-8')
+
+    def load(self, private_key):
+        """Returns the (private key object, PEM private key, PEM public key) of a saved PEM private key"""
+        key = RSA.import_key(private_key)
+        return key, private_key, key.publickey().export_key().decode('utf-8')
+
+    def sign(self, private_key_obj, data):
+        return pkcs1_15.new(private_key_obj).sign(SHA256.new(data))
+
+    def verify(self, public_key_obj, data, signature):
+        try:
+            pkcs1_15.new(public_key_obj).verify(SHA256.new(data), signature)
+            return True
+        except (ValueError, TypeError):
+            return False
+
+
+class Ed25519Scheme:
+    """Ed25519 (RFC 8032) - faster signing, 64-byte signatures and short keys"""
+
+    name = "ed25519"
+
+    def generate(self):
+        """Returns a new (private key object, PEM private key, PEM public key)"""
+        key = ECC.generate(curve="Ed25519")
+        return key, key.export_key(format="PEM"), key.public_key().export_key(format="PEM")
+
+    def load(self, private_key):
+        """Returns the (private key object, PEM private key, PEM public key) of a saved PEM private key"""
+        key = ECC.import_key(private_key)
+        return key, private_key, key.public_key().export_key(format="PEM")
+
+    def sign(self, private_key_obj, data):
+        return eddsa.new(private_key_obj, "rfc8032").sign(data)
+
+    def verify(self, public_key_obj, data, signature):
+        try:
+            eddsa.new(public_key_obj, "rfc8032").verify(data, signature)
+            return True
+        except (ValueError, TypeError):
+            return False
+
+
+SCHEMES = {scheme.name: scheme for scheme in (RSAScheme(), Ed25519Scheme())}
+
+key_cache = KeyCache()  # One per process
+
+
+def scheme_of(public_key_obj):
+    """Returns the scheme a public key object belongs to"""
+    if isinstance(public_key_obj, RSA.RsaKey):
+        return SCHEMES["rsa"]
+    return SCHEMES["ed25519"]
+
+
+def verify(public_key, data, signature):
+    """Checks a signature of data (bytes) made with the PEM public_key, whatever its scheme"""
+    try:
+        public_key_obj = key_cache.get(public_key)
+    except (ValueError, TypeError):
+        return False
+    return scheme_of(public_key_obj).verify(public_key_obj, data, signature)
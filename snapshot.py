@@ -0,0 +1,74 @@
+"""For saving the account state at given block heights and starting again from it"""
+
+import json
+import os
+
+INTERVAL = 100  # A snapshot is taken every INTERVAL blocks
+KEEP = 3  # Snapshots kept (older ones are deleted)
+
+
+class Snapshot:
+    """The balance and stake of every account right after the block at height (with that block's hash)"""
+
+    def __init__(self, height, block_hash, accounts):
+        self.height = height
+        self.block_hash = block_hash
+        self.accounts = accounts  # Mapping of peer id to {'public_key': ..., 'balance': ..., 'stake': ...}
+
+    def to_dict(self):
+        return {"height": self.height, "block_hash": self.block_hash, "accounts": self.accounts}
+
+    @staticmethod
+    def from_dict(data):
+        return Snapshot(data["height"], data["block_hash"], data["accounts"])
+
+    def stakes(self):
+        """Returns the stake of every account"""
+        return {id: account["stake"] for id, account in self.accounts.items()}
+
+    def matches(self, blockchain):
+        """Checks if the snapshot was taken on this chain"""
+        return self.height < len(blockchain.chain) and blockchain.chain[self.height].current_hash == self.block_hash
+
+
+class SnapshotStore:
+    """
+    Keeps the latest snapshots, in memory and (if a directory is given) in files next to the block store,
+    so a restarted node loads the newest one instead of re-executing the whole chain.
+    """
+
+    def __init__(self, directory=None, keep=KEEP):
+        self.directory = directory
+        self.keep = keep
+        self.snapshots = []  # Oldest first
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for name in sorted(os.listdir(directory)):
+                if name.startswith("snapshot-") and name.endswith(".json"):
+                    with open(os.path.join(directory, name)) as file:
+                        self.snapshots.append(Snapshot.from_dict(json.load(file)))
+
+    def path_of(self, height):
+        return os.path.join(self.directory, f"snapshot-{height:010d}.json")
+
+    def save(self, snapshot):
+        """Adds a snapshot and deletes the oldest ones beyond keep"""
+        self.snapshots = [s for s in self.snapshots if s.height < snapshot.height]
+        self.snapshots.append(snapshot)
+        if self.directory is not None:
+            # Written to a temporary file first so a crash never leaves half a snapshot
+            temporary_path = self.path_of(snapshot.height) + ".tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(snapshot.to_dict(), file)
+            os.replace(temporary_path, self.path_of(snapshot.height))
+        while len(self.snapshots) > self.keep:
+            old = self.snapshots.pop(0)
+            if self.directory is not None and os.path.exists(self.path_of(old.height)):
+                os.remove(self.path_of(old.height))
+
+    def latest_matching(self, blockchain):
+        """Returns the newest snapshot taken on this chain (None if there is none)"""
+        for snapshot in reversed(self.snapshots):
+            if snapshot.matches(blockchain):
+                return snapshot
+        return None
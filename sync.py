@@ -0,0 +1,213 @@
+"""For catching up with the blockchain of the other nodes - headers first, then only the missing blocks"""
+
+import threading
+import time
+from block import Block
+from message import Message
+
+HEADERS_PER_REQUEST = 500  # Headers asked from a peer at once
+BLOCKS_PER_REQUEST = 20  # Blocks asked from a peer at once
+MAX_IN_FLIGHT = 8  # Block requests waiting for an answer (spread over the peers)
+REQUEST_TIMEOUT = 5.0  # Seconds before an unanswered request is asked again (from another peer if possible)
+
+
+class Synchronizer:
+    """
+    Nodes announce their height and tip hash (STATUS). A node that is behind asks a peer for the headers
+    after its tip (GET_HEADERS/HEADERS) and checks that they link up, then fetches the blocks of those headers
+    from all peers that have them, several requests at once (GET_BLOCKS/BLOCKS). Blocks are validated and
+    committed in order as they arrive, so catching up takes time proportional to the gap.
+    Answers go back to the peer the request came in from (the id of its connection, never one it claims).
+    """
+
+    def __init__(self, wallet, send):
+        self.wallet = wallet
+        self.send = send  # send(peer_id, message) sends to one peer
+        self.lock = threading.Lock()
+        self.peer_heights = {}  # Mapping of peer id to the height it announced
+        self.headers = {}  # Mapping of height to the header of a block still to be committed
+        self.header_peer = None  # Peer the headers are asked from (None: not asking)
+        self.header_requested = 0  # Time of the last headers request
+        self.next_to_request = None  # Lowest height whose block was not asked for yet
+        self.in_flight = {}  # Mapping of first height to (peer id, count, time asked)
+        self.received = {}  # Mapping of height to a block waiting for the blocks before it
+        self.turn = 0  # For taking turns between the peers
+        self.blocks_synced = 0
+        self.headers_received = 0
+        self.requests_sent = 0
+        self.retries = 0
+
+        t = threading.Thread(target=self.watch)
+        t.daemon = True
+        t.start()
+
+    def height(self):
+        return len(self.wallet.blockchain.chain) - 1
+
+    def status(self):
+        """The STATUS message of this node"""
+        return Message("STATUS", (self.height(), self.wallet.blockchain.get_prevhash()))
+
+    def top_header(self):
+        """The height of the last header we know (our height if there are none)"""
+        return max(self.headers) if self.headers else self.height()
+
+    # ============================ SERVING ============================ #
+
+    def handle_get_headers(self, peer_id, start, count):
+        chain = self.wallet.blockchain.chain
+        headers = []
+        for block in chain[start:min(start + count, len(chain))]:
+            header = block.header()
+            header["current_hash"] = block.current_hash
+            headers.append(header)
+        self.send(peer_id, Message("HEADERS", (self.height(), headers)))
+
+    def handle_get_blocks(self, peer_id, start, count):
+        chain = self.wallet.blockchain.chain
+        blocks = list(chain[start:min(start + count, len(chain))])
+        self.send(peer_id, Message("BLOCKS", (start, blocks)))
+
+    # ============================ CATCHING UP ============================ #
+
+    def handle_status(self, peer_id, height, tip_hash):
+        """A peer announced its tip - start catching up if it is ahead of us"""
+        with self.lock:
+            self.peer_heights[peer_id] = max(height, self.peer_heights.get(peer_id, 0))
+            if height > self.top_header() and self.header_peer is None:
+                self.request_headers(peer_id)
+
+    def request_headers(self, peer_id):
+        self.header_peer = peer_id
+        self.header_requested = time.time()
+        self.requests_sent += 1
+        self.send(peer_id, Message("GET_HEADERS", (self.top_header() + 1, HEADERS_PER_REQUEST)))
+
+    def handle_headers(self, peer_id, height, headers):
+        with self.lock:
+            if peer_id != self.header_peer:
+                return
+            self.header_peer = None
+            self.peer_heights[peer_id] = max(height, self.peer_heights.get(peer_id, 0))
+            for header in headers:
+                index = header["index"]
+                if index != self.top_header() + 1:
+                    continue  # Overlaps what we know already
+                previous = self.headers.get(index - 1)
+                previous_hash = previous["current_hash"] if previous else self.wallet.blockchain.get_prevhash()
+                if header["previous_hash"] != previous_hash or Block.hash_header(header) != header["current_hash"]:
+                    # The peer's chain forked from ours (or sent a forged header) - committed blocks are never replaced
+                    print(f"Headers from {peer_id} do not extend our chain")
+                    self.reset()
+                    return
+                self.headers[index] = header
+                self.headers_received += 1
+
+            if self.next_to_request is None and self.headers:
+                self.next_to_request = min(self.headers)
+            if self.top_header() < self.peer_heights[peer_id] and headers:
+                self.request_headers(peer_id)  # More headers to get
+            self.request_blocks()
+
+    def request_blocks(self):
+        """Asks for the next blocks until MAX_IN_FLIGHT requests are waiting"""
+        peers = sorted(self.peer_heights)
+        while self.next_to_request is not None and len(self.in_flight) < MAX_IN_FLIGHT:
+            start = max(self.next_to_request, self.height() + 1)  # Some may have been broadcast meanwhile
+            if start > self.top_header():
+                break
+            count = min(BLOCKS_PER_REQUEST, self.top_header() - start + 1)
+            # The peers that have all these blocks take turns
+            holders = [peer_id for peer_id in peers if self.peer_heights[peer_id] >= start + count - 1]
+            if not holders:
+                break
+            self.turn += 1
+            self.ask_blocks(holders[self.turn % len(holders)], start, count)
+            self.next_to_request = start + count
+
+    def ask_blocks(self, peer_id, start, count):
+        self.in_flight[start] = (peer_id, count, time.time())
+        self.requests_sent += 1
+        self.send(peer_id, Message("GET_BLOCKS", (start, count)))
+
+    def ask_again(self, peer_id, start, count):
+        """Asks for blocks again, from another peer that has them if there is one"""
+        self.retries += 1
+        holders = [
+            other for other, height in sorted(self.peer_heights.items())
+            if height >= start + count - 1 and other != peer_id
+        ]
+        self.turn += 1
+        self.ask_blocks(holders[self.turn % len(holders)] if holders else peer_id, start, count)
+
+    def handle_blocks(self, peer_id, start, blocks):
+        with self.lock:
+            request = self.in_flight.get(start)
+            if request is None or request[0] != peer_id:
+                return  # Asked again from another peer in the meantime
+            del self.in_flight[start]
+            for block in blocks:
+                header = self.headers.get(block.index)
+                # The block must be the one announced by its header (its contents are checked when committed)
+                if header is not None and header["current_hash"] == block.current_hash:
+                    self.received[block.index] = block
+            if len(blocks) < request[1]:
+                # The peer does not have them all - ask another peer for the rest
+                self.peer_heights[peer_id] = start + len(blocks) - 1
+                self.ask_again(peer_id, start + len(blocks), request[1] - len(blocks))
+            self.commit_received()
+            self.request_blocks()
+
+    def commit_received(self):
+        """Validates and commits the received blocks that follow our tip, in order"""
+        while self.height() + 1 in self.received:
+            block = self.received.pop(self.height() + 1)
+            self.headers.pop(block.index, None)
+            if not self.wallet.extend_chain(block):
+                print(f"Invalid block {block.index} received while catching up")
+                self.reset()
+                return
+            self.blocks_synced += 1
+        # Blocks committed in the meantime (e.g. broadcast ones) need no fetching
+        for height in [height for height in self.headers if height <= self.height()]:
+            del self.headers[height]
+        if not self.headers and not self.in_flight and self.header_peer is None:
+            self.next_to_request = None
+
+    def reset(self):
+        """Drops the state of the current catch-up"""
+        self.headers = {}
+        self.header_peer = None
+        self.next_to_request = None
+        self.in_flight = {}
+        self.received = {}
+
+    def watch(self):
+        """Asks again for whatever was not answered within REQUEST_TIMEOUT"""
+        while True:
+            time.sleep(REQUEST_TIMEOUT / 2)
+            with self.lock:
+                now = time.time()
+                if self.header_peer is not None and now - self.header_requested > REQUEST_TIMEOUT:
+                    self.retries += 1
+                    self.header_peer = None
+                    ahead = [peer_id for peer_id, height in self.peer_heights.items() if height > self.top_header()]
+                    if ahead:
+                        self.request_headers(ahead[self.turn % len(ahead)])
+                for start, (peer_id, count, asked) in list(self.in_flight.items()):
+                    if now - asked > REQUEST_TIMEOUT:
+                        self.ask_again(peer_id, start, count)
+
+    def stats(self):
+        """Returns the progress of catching up"""
+        with self.lock:
+            return {
+                "height": self.height(),
+                "target": max(self.peer_heights.values(), default=self.height()),
+                "headers_pending": len(self.headers),
+                "in_flight": len(self.in_flight),
+                "blocks_synced": self.blocks_synced,
+                "headers_received": self.headers_received,
+                "requests": self.requests_sent,
+                "retries": self.retries,
+            }
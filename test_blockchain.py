@@ -0,0 +1,91 @@
+"""Tests of moving a blockchain to a BlockStore (Blockchain.persist)"""
+
+import config
+
+config.N = 3
+config.CAPACITY = 2
+
+import pytest
+
+from block import Block
+from block_store import BlockStore
+from blockchain import Blockchain
+
+
+def grow(blockchain, count):
+    """Appends count empty blocks to the chain"""
+    for _ in range(count):
+        blockchain.add_block(Block([], blockchain.get_prevhash(), "validator", blockchain.next_index()))
+
+
+def copy_of(blockchain):
+    """A received copy of the chain (the list of the same blocks)"""
+    copy = Blockchain.__new__(Blockchain)
+    copy.chain = list(blockchain.chain)
+    copy.store = None
+    copy.rebuild_transaction_index()
+    return copy
+
+
+def hashes(chain):
+    return [block.current_hash for block in chain]
+
+
+def test_store_is_a_prefix_of_the_received_chain(tmp_path):
+    blockchain = Blockchain("bootstrap")
+    grow(blockchain, 3)
+    store = BlockStore(str(tmp_path))
+    copy_of(blockchain).persist(store)
+    assert len(store) == 4
+
+    grow(blockchain, 2)
+    received = copy_of(blockchain)
+    received.persist(store)
+    assert len(store) == 6
+    assert hashes(store) == hashes(blockchain.chain)
+    assert received.chain is store
+    assert received.contains_transaction(blockchain.chain[0].transactions[0].transaction_id)
+
+
+def test_store_ahead_of_the_received_chain_is_truncated(tmp_path):
+    blockchain = Blockchain("bootstrap")
+    grow(blockchain, 2)
+    received = copy_of(blockchain)
+    grow(blockchain, 3)
+    store = BlockStore(str(tmp_path))
+    copy_of(blockchain).persist(store)
+
+    received.persist(store)
+    assert hashes(store) == hashes(blockchain.chain[:3])
+
+
+def test_store_on_another_fork_is_rewritten_from_the_shared_blocks(tmp_path):
+    blockchain = Blockchain("bootstrap")
+    grow(blockchain, 2)
+    fork = copy_of(blockchain)
+    grow(blockchain, 2)
+    grow(fork, 3)
+    store = BlockStore(str(tmp_path))
+    copy_of(blockchain).persist(store)
+
+    fork.persist(store)
+    assert hashes(store) == hashes(fork.chain)
+    assert store.height_of(blockchain.chain[3].current_hash) is None
+
+
+def test_store_of_another_blockchain_is_never_overwritten(tmp_path):
+    store = BlockStore(str(tmp_path))
+    copy_of(Blockchain("bootstrap")).persist(store)
+    with pytest.raises(ValueError):
+        copy_of(Blockchain("another bootstrap")).persist(store)
+    assert len(store) == 1
+
+
+def test_reopened_store_keeps_the_appended_blocks(tmp_path):
+    blockchain = Blockchain("bootstrap")
+    grow(blockchain, 3)
+    store = BlockStore(str(tmp_path))
+    copy_of(blockchain).persist(store)
+    store.close()
+
+    assert hashes(BlockStore(str(tmp_path))) == hashes(blockchain.chain)
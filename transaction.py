@@ -49,6 +49,12 @@ class Transaction:
 
         return transaction_id
     
+    def __setattr__(self, name, value):
+        # Any change to the transaction drops its cached canonical encoding
+        if name != "canonical_cache":
+            self.__dict__["canonical_cache"] = None
+        object.__setattr__(self, name, value)
+
     def transaction_signing(self, signature):
         self.signature = signature
 
@@ -68,6 +74,19 @@ class Transaction:
             "signature": self.signature,
         }
 
+    def canonical_bytes(self):
+        """
+        The deterministic byte encoding of to_dict (signature in hex), built once and cached.
+        """
+        cached = self.__dict__.get("canonical_cache")
+        if cached is None:
+            data = self.to_dict()
+            if data["signature"] is not None:
+                data["signature"] = data["signature"].hex()
+            cached = json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+            self.canonical_cache = cached
+        return cached
+
     def equals(self, transaction):
         """
         Check if two transactions are equal.
@@ -1,37 +1,134 @@
 """For creating and managing a list of transactions"""
+import heapq
+from bisect import insort
 from config import CAPACITY
 
+COMPACT_AFTER = 32  # Removed entries a sender's queue may hold before it is rebuilt
+
 
 class TransactionPool:
-    """For creating and managing a list of transactions"""
+    """
+    For creating and managing a list of transactions.
+    Transactions are kept by id (in arrival order) and, for every sender, in nonce order
+    so the best-paying transactions can be picked without breaking any sender's nonce order.
+    Only validated transactions enter the pool, so their signatures are never checked again; the pool
+    remembers the changes each one made to the temporary balances so they can be undone one by one.
+    """
 
     def __init__(self):
-        self.transactions = []  # A list of transactions
+        self.transactions = {}  # Mapping of transaction_id to transaction, in arrival order
+        self.effects = {}  # Mapping of transaction_id to the {id: change} it made to the temporary balances
+        self.by_sender = {}  # Mapping of sender_address to [(nonce, arrival, transaction_id)] sorted by nonce
+        self.removed = {}  # Mapping of sender_address to how many entries of its queue were removed from the pool
+        self.arrivals = 0
+        self.wallet = None
 
     def set_wallet(self, wallet):
         """Sets the wallet"""
         self.wallet = wallet
 
-    def add_transaction(self, transaction):
-        """Adds transaction to list"""
+    def add_transaction(self, transaction, effects=None):
+        """Adds a validated transaction to the pool, with the changes it made to the temporary balances"""
         with self.wallet.lock:
-            self.transactions.append(transaction)
+            if transaction.transaction_id in self.transactions:
+                return
+            self.transactions[transaction.transaction_id] = transaction
+            self.effects[transaction.transaction_id] = effects or {}
+            self.arrivals += 1
+            entry = (transaction.nonce, self.arrivals, transaction.transaction_id)
+            queue = self.by_sender.setdefault(transaction.sender_address, [])
+            if not queue or queue[-1] < entry:
+                queue.append(entry)  # Usual case - nonces of a sender arrive in order
+            else:
+                insort(queue, entry)
 
     def transaction_exists(self, transaction):
-        """Checks if a transaction exists in the list"""
-        for pool_transaction in self.transactions:
-            if pool_transaction.equals(transaction):
-                return True
-        return False
+        """Checks if a transaction exists in the pool"""
+        return transaction.transaction_id in self.transactions
+
+    def discard(self, transaction):
+        """
+        Removes a transaction from the pool (its entry in the sender's queue is dropped lazily).
+        Returns the changes it made to the temporary balances (None if it was not in the pool)
+        """
+        if self.transactions.pop(transaction.transaction_id, None) is None:
+            return None
+        effects = self.effects.pop(transaction.transaction_id)
+        sender = transaction.sender_address
+        self.removed[sender] = self.removed.get(sender, 0) + 1
+        queue = self.by_sender[sender]
+        if self.removed[sender] > COMPACT_AFTER and self.removed[sender] * 2 > len(queue):
+            queue[:] = [entry for entry in queue if entry[2] in self.transactions]
+            self.removed[sender] = 0
+        if not queue or self.removed[sender] == len(queue):
+            del self.by_sender[sender]
+            del self.removed[sender]
+        return effects
+
+    def clear(self):
+        """Empties the pool"""
+        self.transactions = {}
+        self.effects = {}
+        self.by_sender = {}
+        self.removed = {}
 
     def remove_from_pool(self, transactions):
-        """Removes transactions from the pool, i.e., if they have been added to a block"""
+        """
+        Removes transactions from the pool, i.e., if they have been added to a block.
+        Returns (transaction, changes it made to the temporary balances or None if it was not in the pool)
+        for every transaction
+        """
+        with self.wallet.lock:
+            return [(transaction, self.discard(transaction)) for transaction in transactions]
+
+    def pending_of(self, sender_address):
+        """Returns the transactions of a sender that are in the pool, in nonce order"""
         with self.wallet.lock:
-            rest_transactions = [t1 for t1 in self.transactions if not any(t1.equals(t2) for t2 in transactions)]
-            self.transactions = []
-        for transaction in rest_transactions:
-            if self.wallet is not None:
-                self.wallet.handle_transaction(transaction, True)
+            queue = self.by_sender.get(sender_address, [])
+            return [self.transactions[entry[2]] for entry in queue if entry[2] in self.transactions]
+
+    def next_in_queue(self, queue, position):
+        """Returns the position of the first entry from position on that is still in the pool (None if none)"""
+        while position < len(queue):
+            if queue[position][2] in self.transactions:
+                return position
+            position += 1
+        return None
+
+    def select_transactions(self, count, accept=None):
+        """
+        Picks up to count transactions, highest fee first, where a sender's transaction is only picked after
+        all its pending transactions with a lower nonce. accept(transaction) may refuse a transaction
+        (e.g. if the sender cannot cover it yet); the sender is then set aside until a picked transaction
+        pays it something.
+        """
+        with self.wallet.lock:
+            heads = []  # Heap of the best pickable transaction of every sender
+            for sender, queue in self.by_sender.items():
+                position = self.next_in_queue(queue, 0)
+                if position is not None:
+                    transaction = self.transactions[queue[position][2]]
+                    heads.append((-transaction.fee, queue[position][1], sender, position))
+            heapq.heapify(heads)
+
+            selected = []
+            set_aside = {}  # Mapping of sender to its refused head
+            while heads and len(selected) < count:
+                head = heapq.heappop(heads)
+                _, _, sender, position = head
+                queue = self.by_sender[sender]
+                transaction = self.transactions[queue[position][2]]
+                if accept is not None and not accept(transaction):
+                    set_aside[sender] = head
+                    continue
+                selected.append(transaction)
+                if transaction.receiver_address in set_aside:
+                    heapq.heappush(heads, set_aside.pop(transaction.receiver_address))
+                position = self.next_in_queue(queue, position + 1)
+                if position is not None:
+                    transaction = self.transactions[queue[position][2]]
+                    heapq.heappush(heads, (-transaction.fee, queue[position][1], sender, position))
+            return selected
 
     def validation_required(self):
         """Decides if it is time to create a new block"""
@@ -0,0 +1,150 @@
+"""For verifying transaction signatures in batches on a pool of processes (one per core)"""
+
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import signatures
+
+BATCH_SIZE = 64  # Transactions verified per task
+FLUSH_LATENCY = 0.005  # Seconds a transaction waits for its batch to fill up
+MAX_IN_FLIGHT = 64  # Batches handed to the pool but not delivered yet (submit blocks beyond that)
+MAX_QUEUED = 1000  # Transactions waiting for a batch (as the dispatcher's QUEUE_SIZE)
+
+
+def signing_bytes(transaction_data):
+    """The bytes that are signed for a transaction payload"""
+    return json.dumps(transaction_data).encode('utf-8')
+
+
+def verify_signature(public_key, data, signature):
+    """Checks a signature of data (bytes) made with the PEM public_key (parsed keys are cached per process)"""
+    return signatures.verify(public_key, data, signature)
+
+
+def verify_batch(items):
+    """Runs in a pool process - verifies (public_key, data, signature) items, returns the results in order"""
+    return [verify_signature(public_key, data, signature) for public_key, data, signature in items]
+
+
+class BatchVerifier:
+    """
+    Collects submitted transactions into batches (up to batch_size, or whatever arrived within flush_latency)
+    and verifies them on a process pool. The callback receives (transaction, valid, context) for every
+    transaction, in the order they were submitted. At most max_queued transactions wait: beyond that
+    submit blocks, like the dispatcher, or drops the transaction once drop_timeout expires.
+    The ids of the submitted transactions are kept until the receiver reports them done (see verifying).
+    """
+
+    def __init__(self, callback, batch_size=BATCH_SIZE, flush_latency=FLUSH_LATENCY, processes=None,
+                 max_queued=MAX_QUEUED, drop_timeout=None):
+        self.callback = callback
+        self.batch_size = batch_size
+        self.flush_latency = flush_latency
+        self.drop_timeout = drop_timeout  # None: wait for space as long as needed
+        # spawn: forking a process that already runs network threads is not safe
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes or os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
+        )
+        self.incoming = queue.Queue(max_queued)
+        self.in_flight = queue.Queue(MAX_IN_FLIGHT)  # (batch, future) in submission order
+        self.pending_ids = {}  # Mapping of transaction_id to its submissions not reported done yet
+        self.ids_lock = threading.Lock()
+        self.verified = 0
+        self.batches = 0
+        self.dropped = 0
+
+        for target in (self.collect, self.deliver):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def submit(self, transaction, context=None):
+        """Queues a transaction for verification - blocks while the queue is full (returns False if dropped)"""
+        self.track([transaction], 1)
+        try:
+            self.incoming.put((transaction, context), timeout=self.drop_timeout)
+            return True
+        except queue.Full:
+            self.track([transaction], -1)
+            self.dropped += 1
+            return False
+
+    def track(self, transactions, change):
+        with self.ids_lock:
+            for transaction in transactions:
+                count = self.pending_ids.get(transaction.transaction_id, 0) + change
+                if count > 0:
+                    self.pending_ids[transaction.transaction_id] = count
+                else:
+                    self.pending_ids.pop(transaction.transaction_id, None)
+
+    def done(self, transactions):
+        """The receiver has handled the results of these transactions (e.g. put them in the pool)"""
+        self.track(transactions, -1)
+
+    def verifying(self, transaction_id):
+        """Checks whether a transaction was submitted and its result is not handled yet"""
+        return transaction_id in self.pending_ids
+
+    def full(self):
+        """Checks whether submit would have to wait for space"""
+        return self.incoming.full()
+
+    def collect(self):
+        """Groups the queued transactions into batches and hands them to the pool"""
+        while True:
+            batch = [self.incoming.get()]
+            deadline = time.monotonic() + self.flush_latency
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.incoming.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            items = []
+            for transaction, _ in batch:
+                try:
+                    data = signing_bytes(transaction.payload())
+                    items.append((transaction.sender_address, data, transaction.signature))
+                except (TypeError, ValueError):
+                    items.append(("", b"", b""))  # Fields that cannot be signed (e.g. bytes) - never valid
+            self.in_flight.put((batch, self.executor.submit(verify_batch, items)))
+
+    def deliver(self):
+        """Waits for the batches in submission order and passes every result to the callback"""
+        while True:
+            batch, future = self.in_flight.get()
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"Signature verification failed: {e}")
+                results = [False] * len(batch)
+            self.batches += 1
+            self.verified += len(batch)
+            for (transaction, context), valid in zip(batch, results):
+                try:
+                    self.callback(transaction, valid, context)
+                except Exception as e:
+                    print(f"Error while handling verified transaction: {e}")
+
+    def stats(self):
+        """Returns how many transactions and batches were verified, dropped and how many are waiting"""
+        return {
+            "verified": self.verified,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "waiting": self.incoming.qsize(),
+            "in_flight": self.in_flight.qsize(),
+            "pending_ids": len(self.pending_ids),
+        }
+
+    def shutdown(self):
+        """Stops the pool processes"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
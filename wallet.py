@@ -1,32 +1,45 @@
-from config import N, CAPACITY
-from Crypto.PublicKey import RSA    # pycryptodome
-from Crypto.Signature import pkcs1_15
-from Crypto.Hash import SHA256
-import pickle
+from config import N, CAPACITY, STAKE, SIGNATURE_SCHEME, BATCH_WINDOW, COMPACT_BLOCKS
+from signatures import SCHEMES
+from verifier import signing_bytes, verify_signature
 from transaction import Transaction
 from block import Block
 from blockchain import Blockchain
 from transaction_pool import TransactionPool
 from message import Message
-import json
-from utils import BlockChainUtils
+from codec import Codec
 from proof_of_stake import ProofOfStake
+from address_book import AddressBook
+from framing import encode_frame
+from snapshot import Snapshot, SnapshotStore, INTERVAL as SNAPSHOT_INTERVAL
+from batching import TransactionBatcher
+from compact import compact_block
 import threading
 
+EPSILON = 1e-9  # Rounding tolerated before a balance counts as overdrawn
+
 class Wallet:
 
-    def __init__(self):
-        self.generate_wallet()
+    def __init__(self, scheme=SIGNATURE_SCHEME, private_key=None):
+        if private_key is None:
+            self.generate_wallet(scheme)
+        else:
+            self.load_wallet(scheme, private_key)  # The keys of a restarted node
         self.nonce = 0
         self.transaction_pool = TransactionPool()
         self.transaction_pool.set_wallet(self)
         self.pos = ProofOfStake()
         self.await_block = False
         self.lock = threading.RLock()
+        self.snapshots = SnapshotStore()  # In memory unless set_snapshots gives one backed by files
+        self.gossip = None  # Gossip overlay the broadcasts go through (None: sent to every peer)
+        self.scheduler = None  # Decides when to mint blocks (None: minted on the thread that fills the pool)
+        # Transactions broadcast within BATCH_WINDOW go out as one message
+        self.batcher = TransactionBatcher(self.broadcast_batch, BATCH_WINDOW) if BATCH_WINDOW else None
 
-    def set_peers(self, peers, nodes):
+    def set_peers(self, peers, outbound):
         self.peers = peers
-        self.nodes = nodes
+        self.outbound = outbound  # Outbound queues of the peers
+        self.address_book = AddressBook(peers)
         stakes_dict = {}
         self.temp_balance = {}
         for id, dict in self.peers.items():
@@ -36,41 +49,40 @@ class Wallet:
 
         self.pos.set_stakes(stakes_dict)
 
-        self.id = None
-        for id, dict in self.peers.items():
-            if dict["public_key"] == self.public_key:
-                self.id = id
-                break
+        self.id = self.address_book.id_of(self.public_key)
         self.temp_stake = self.peers[self.id]["stake"]
 
     def set_blockchain(self, blockchain:Blockchain):
         self.blockchain = blockchain
+
+    def set_snapshots(self, snapshots:SnapshotStore):
+        self.snapshots = snapshots
+
+    def set_gossip(self, gossip):
+        self.gossip = gossip
+
+    def set_scheduler(self, scheduler):
+        self.scheduler = scheduler
     
-    def generate_wallet(self):
-        key = RSA.generate(2048)
-        self.private_key = key.export_key().decode('utf-8')
-        self.public_key = key.publickey().export_key().decode('utf-8')
+    def generate_wallet(self, scheme=SIGNATURE_SCHEME):
+        self.signature_scheme = SCHEMES[scheme]
+        # The key object is kept so signing does not parse the PEM private key every time
+        self.private_key_obj, self.private_key, self.public_key = self.signature_scheme.generate()
+
+    def load_wallet(self, scheme, private_key):
+        self.signature_scheme = SCHEMES[scheme]
+        self.private_key_obj, self.private_key, self.public_key = self.signature_scheme.load(private_key)
 
 
     # ============================ TRANSACTION ============================ #
     
     def sign_transaction(self, transaction_data):
-        private_key_obj = RSA.import_key(self.private_key)
-        transaction_data = json.dumps(transaction_data).encode('utf-8')
-        hash_data = SHA256.new(transaction_data)        # transaction_data.encode('utf-8')
-        signature = pkcs1_15.new(private_key_obj).sign(hash_data)
+        signature = self.signature_scheme.sign(self.private_key_obj, signing_bytes(transaction_data))
         return signature
     
     def verify_transaction(self, public_key, transaction_data, signature):
-        public_key_obj = RSA.import_key(public_key)
-        transaction_data = json.dumps(transaction_data).encode('utf-8')
-        hash_data = SHA256.new(transaction_data)        # transaction_data.encode('utf-8')
-        try:
-            pkcs1_15.new(public_key_obj).verify(hash_data, signature)
-            return True
-        except (ValueError, TypeError):
-            return False
-        
+        return verify_signature(public_key, signing_bytes(transaction_data), signature)
+
 
     def create_transaction(self, receiver_address, type, amount, message):
         transaction = Transaction(type, receiver_address, self.public_key, amount, message, self.nonce)
@@ -86,39 +98,50 @@ class Wallet:
         with self.lock:
             if self.validate_transaction(transaction):
                 # If the signature is valid and the transaction is new, it is added to the pool
-                self.transaction_pool.add_transaction(transaction)
-                self.temp_execute_transaction(transaction)
+                effects = self.temp_execute_transaction(transaction)
+                self.transaction_pool.add_transaction(transaction, effects)
                 return transaction
             else:
                 print("Invalid transaction")
                 return None
         
-    def handle_transaction(self, transaction:Transaction, flag = False):
+    def handle_transaction(self, transaction:Transaction, flag = False, signature_valid = None):
         """
         Checks if transaction is valid and does not already exist - if valid it broadcasts it
+        signature_valid is the result of an earlier signature check (e.g. by the BatchVerifier), None to check here
         """
         with self.lock:
-            if self.validate_transaction(transaction):
+            if self.transaction_pool.transaction_exists(transaction) or self.transaction_in_blockchain(transaction):
+                # A copy of one we hold (e.g. it arrived after the block that committed it) - nothing to do
+                return
+            if self.validate_transaction(transaction, signature_valid):
                 # If the signature is valid and the transaction is new, it is added to the pool
-                self.transaction_pool.add_transaction(transaction)
-                self.temp_execute_transaction(transaction)
+                effects = self.temp_execute_transaction(transaction)
+                self.transaction_pool.add_transaction(transaction, effects)
 
-                if self.transaction_pool.validation_required() and not self.await_block and not flag:
-                        block = self.mint_block()
-                        if block is not None:
-                            self.broadcast_block(block)
+                if not flag:
+                    self.pool_changed()
             else:
                 print("Invalid transaction")
 
-    def validate_transaction(self, transaction:Transaction):
+    def handle_transactions(self, results):
         """
-        Validates a transaction
+        Handles a received batch of transactions at once - results holds (transaction, signature_valid) pairs
         """
-        data = transaction.payload()
-        signature = transaction.signature
-        signer_address = transaction.sender_address
+        with self.lock:
+            for transaction, signature_valid in results:
+                self.handle_transaction(transaction, signature_valid=signature_valid)
 
-        signature_valid = self.verify_transaction(signer_address, data, signature)  # Check if signature is valid
+    def validate_transaction(self, transaction:Transaction, signature_valid = None):
+        """
+        Validates a transaction (the signature is only checked if signature_valid is None)
+        """
+        if signature_valid is None:
+            data = transaction.payload()
+            signature = transaction.signature
+            signer_address = transaction.sender_address
+
+            signature_valid = self.verify_transaction(signer_address, data, signature)  # Check if signature is valid
 
         with self.lock:
             transaction_covered = self.transaction_covered(transaction)
@@ -134,10 +157,7 @@ class Wallet:
     
     def transaction_covered(self, transaction:Transaction):
         """ Checks whether the sender has enough money to execute this transaction """
-        sender_id = None
-        for id, dict_id in self.peers.items():
-            if dict_id["public_key"] == transaction.sender_address:
-                sender_id = id
+        sender_id = self.address_book.id_of(transaction.sender_address)
         current_balance = self.temp_balance[sender_id]
         if current_balance >= transaction.amount + transaction.fee:
             return True
@@ -146,94 +166,82 @@ class Wallet:
         
     def transaction_in_blockchain(self, transaction:Transaction):
         """ Checks whether a transaction is already in our blockchain """
-        for block in self.blockchain.chain:
-            for t in block.transactions:
-                if transaction.equals(t):
-                    return True
-        
-        return False
+        return self.blockchain.contains_transaction(transaction.transaction_id)
 
         
     def broadcast_transaction(self, transaction: Transaction):
         """ Broadcasts Transaction """
-        with self.lock:
-            message = Message("TRANSACTION", transaction)
-            message = BlockChainUtils.encode(message)
-
-            if message is not None:
-                message = pickle.dumps(message)
-                for socket in self.nodes.values():
-                    socket.sendall(message)
-    
-    def execute_transaction(self, transaction:Transaction):
-        """ Executes a Transaction saving its changes to the wallets"""
-        with self.lock:
-            # If the transaction is Exchange or Initialization then remove from sender balance and add to receiver
-            if transaction.type == "Exchange" or transaction.type == "Initialization":    
-                receiver_id = None
-                sender_id = None
-                for id, dict_id in self.peers.items():
-                    if dict_id["public_key"] == transaction.receiver_address:
-                        receiver_id = id
-                    if dict_id["public_key"] == transaction.sender_address:
-                        sender_id = id
-                
-                self.peers[sender_id]["balance"] -= (transaction.amount + transaction.fee)
-                self.peers[receiver_id]["balance"] += transaction.amount
-
-            elif transaction.type == "Stake":       # If the transaction is Stake then remove the money from the balance
-                sender_id = None
-                for id, dict_id in self.peers.items():
-                    if dict_id["public_key"] == transaction.sender_address:
-                        sender_id = id
-                
-                previous_stake = self.peers[sender_id]["stake"]
-                
-                self.peers[sender_id]["stake"] = transaction.amount
+        if self.batcher is not None:
+            self.batcher.add(transaction)
+        else:
+            self.broadcast(Message("TRANSACTION", transaction))
 
-                self.peers[sender_id]["balance"] -= (transaction.amount - previous_stake)
+    def broadcast_batch(self, transactions):
+        """ Broadcasts the transactions collected by the batcher """
+        if len(transactions) == 1:
+            self.broadcast(Message("TRANSACTION", transactions[0]))
+        else:
+            self.broadcast(Message("TRANSACTION_BATCH", transactions))
 
+    def broadcast(self, message:Message):
+        """
+        Sends a message to every peer - directly, or through the gossip overlay if there is one.
+        It is only queued for every peer, so a slow peer never holds up the wallet.
+        """
+        if self.batcher is not None and message.message_type not in ("TRANSACTION", "TRANSACTION_BATCH"):
+            # Transactions waiting for their batch go first (a block may hold them)
+            self.batcher.flush()
+        if self.gossip is not None:
+            self.gossip.publish(message)
+            return
+        self.outbound.broadcast(encode_frame(Codec.encode(message)))
+    
     def temp_execute_transaction(self, transaction:Transaction):
-        """ Executes a Transaction saving its changes to the wallets"""
+        """ Executes a Transaction saving its changes to the wallets - returns the changes ({id: change})"""
         # If the transaction is Exchange or Initialization then remove from sender balance and add to receiver
         with self.lock:
+            effects = {}
             if transaction.type == "Exchange" or transaction.type == "Initialization":    
-                receiver_id = None
-                sender_id = None
-                for id, dict_id in self.peers.items():
-                    if dict_id["public_key"] == transaction.receiver_address:
-                        receiver_id = id
-                    if dict_id["public_key"] == transaction.sender_address:
-                        sender_id = id
+                receiver_id = self.address_book.id_of(transaction.receiver_address)
+                sender_id = self.address_book.id_of(transaction.sender_address)
                 
                 self.temp_balance[sender_id] -= (transaction.amount + transaction.fee)
                 self.temp_balance[receiver_id] += transaction.amount
+                effects[sender_id] = -(transaction.amount + transaction.fee)
+                effects[receiver_id] = effects.get(receiver_id, 0) + transaction.amount
 
             elif transaction.type == "Stake":       # If the transaction is Stake then remove the money from the balance
-                sender_id = None
-                for id, dict_id in self.peers.items():
-                    if dict_id["public_key"] == transaction.sender_address:
-                        sender_id = id
+                sender_id = self.address_book.id_of(transaction.sender_address)
 
                 previous_stake = self.temp_stake
                 self.temp_stake = transaction.amount
                 self.temp_balance[sender_id] += previous_stake
                 self.temp_balance[sender_id] -= transaction.amount
+                effects[sender_id] = previous_stake - transaction.amount
+            return effects
 
     def initial_distribution(self):
         """ Executes initialization transactions to all peers only from 0 so everyone has 1000 balance """
         for i in range(N):
             if i != 0:
-                receiver_address = self.peers['id'+ str(i)]["public_key"]
+                receiver_address = self.address_book.public_key_of('id'+ str(i))
                 transaction = self.create_transaction(receiver_address, "Initialization", 1000, "")
 
                 if self.check_transaction(transaction) is not None:
                     self.broadcast_transaction(transaction)
+                    self.pool_changed()
 
-                if self.transaction_pool.validation_required():
-                    block = self.mint_block()
-                    if block is not None:
-                        self.broadcast_block(block)
+    def pool_changed(self):
+        """
+        Called when transactions entered the pool - the scheduler decides whether to mint a block
+        (a wallet without one, e.g. in a benchmark, mints it here if the pool is full)
+        """
+        if self.scheduler is not None:
+            self.scheduler.notify()
+        elif self.transaction_pool.validation_required() and not self.await_block:
+            block = self.mint_block()
+            if block is not None:
+                self.broadcast_block(block)
 
 
     # ========================= BLOCK ========================== #
@@ -242,53 +250,97 @@ class Wallet:
         """
         Checks if block is valid - if valid it add it to your blockchain
         """
-        if self.validate_block(block):
-            with self.lock:
-                # If block is valid then execute any transactions that are in the block and not in the pool
-                for transaction in block.transactions:
-                    self.execute_transaction(transaction)
-
-                self.fix_temp_balances()
-
-                self.transaction_pool.remove_from_pool(
-                    block.transactions
-                )
-
-                # And add the block to the blockchain
-                self.stakes_and_messages(block)
-                fees = self.blockchain.add_block(block)
-                validator_id = None
-                for id, dict in self.peers.items():
-                    if dict["public_key"] == block.validator:
-                        validator_id = id
-                        break
-                self.peers[validator_id]["balance"] += fees
-                self.temp_balance[validator_id] += fees
-
-        else:
-            print("Invalid block")
+        # Validated and committed under one lock, so no other block is committed in between
+        with self.lock:
+            if self.validate_block(block):
+                self.commit_block(block)
+            else:
+                print("Invalid block")
         self.await_block = False
+        if self.scheduler is not None:
+            # The pool may be full already, waiting for this block
+            self.scheduler.notify()
+
+    def extend_chain(self, block:Block):
+        """
+        Validates and commits a block fetched while catching up - returns False if it is invalid
+        """
+        with self.lock:
+            if block.index < self.blockchain.next_index():
+                return block.current_hash == self.blockchain.chain[block.index].current_hash
+            if not self.validate_block(block):
+                return False
+            self.commit_block(block)
+            self.await_block = False
+            if self.scheduler is not None:
+                self.scheduler.notify()
+            return True
 
     def validate_block(self, block:Block):
         """
-        Validates a block
+        Validates a block (including that it overdraws no account)
         """
         # My info
         prev_hash = self.blockchain.get_prevhash()
         validator_id = self.pos.validator(prev_hash)
-        validator_pk = self.peers[validator_id]["public_key"]
+        validator_pk = self.address_book.public_key_of(validator_id)
+
+        return self.check_block(block, prev_hash, validator_pk) and self.block_covered(block)
 
+    def check_block(self, block:Block, prev_hash, validator_pk):
+        """
+        Checks that a block follows prev_hash, was made by validator_pk and that its hashes match its contents
+        """
         # Block info
         block_validator = block.validator
         block_prev_hash = block.previous_hash
+        block_merkle_root = block.merkle_root
 
         if (
             block_validator == validator_pk
             and block_prev_hash == prev_hash
+            and block_merkle_root == block.compute_merkle_root()
+            and block.current_hash == block.hash_block()
         ):
             return True
         return False
 
+    def work_out_block(self, block:Block):
+        """
+        Returns the validated balances and stakes of every account after the block (without changing them),
+        or None if the block names an account we do not know
+        """
+        balances = {id: data["balance"] for id, data in self.peers.items()}
+        stakes = {id: data["stake"] for id, data in self.peers.items()}
+        validator_id = self.address_book.id_of(block.validator)
+        if validator_id is None:
+            return None
+        for transaction in block.transactions:
+            sender_id = self.address_book.id_of(transaction.sender_address)
+            if sender_id is None:
+                return None
+            if transaction.type == "Exchange" or transaction.type == "Initialization":
+                receiver_id = self.address_book.id_of(transaction.receiver_address)
+                if receiver_id is None:
+                    return None
+                balances[sender_id] -= (transaction.amount + transaction.fee)
+                balances[receiver_id] += transaction.amount
+            elif transaction.type == "Stake":       # Staking more locks coins away, staking less gives them back
+                balances[sender_id] -= (transaction.amount - stakes[sender_id])
+                stakes[sender_id] = transaction.amount
+        balances[validator_id] += block.sum_fees()
+        return balances, stakes
+
+    def block_covered(self, block:Block):
+        """ Checks that a block names only known accounts and overdraws none of them """
+        worked_out = self.work_out_block(block)
+        if worked_out is None:
+            return False
+        balances = worked_out[0]
+        return all(
+            balance >= -EPSILON or balance >= self.peers[id]["balance"] for id, balance in balances.items()
+        )
+
     def mint_block(self):
         """
         Checks if you are the validator and triggers block creation if necessary
@@ -296,81 +348,202 @@ class Wallet:
         with self.lock:
             prev_hash = self.blockchain.get_prevhash()
             validator_id = self.pos.validator(prev_hash)
-            validator_pk = self.peers[validator_id]["public_key"]
+            validator_pk = self.address_book.public_key_of(validator_id)
             if validator_pk == self.public_key:
                 print("I am the validator")
                 index = self.blockchain.next_index()
-                block = Block(self.transaction_pool.transactions[:CAPACITY], prev_hash, validator_pk, index)
-                for transaction in block.transactions:
-                    self.execute_transaction(transaction)
-
-                self.fix_temp_balances()
-
-                self.transaction_pool.remove_from_pool(
-                    block.transactions
-                )  # Clears transaction pool by removing all transactions added to block
-
-                self.stakes_and_messages(block)
-                fees = self.blockchain.add_block(block)
-                validator_id = None
-                for id, dict in self.peers.items():
-                    if dict["public_key"] == block.validator:
-                        validator_id = id
-                        break
-                self.peers[validator_id]["balance"] += fees
-                self.temp_balance[validator_id] += fees
-
+                transactions = self.transaction_pool.select_transactions(CAPACITY, self.covered_in_block())
+                block = Block(transactions, prev_hash, validator_pk, index)
+                self.commit_block(block)
                 return block
             else:
                 print("I am not the validator")
                 self.await_block = True
                 return None
 
-    def fix_balances(self):
-        for id, balance in self.temp_balance.items():
-            self.peers[id]["balance"] = balance
+    def commit_block(self, block:Block):
+        """
+        Executes a valid block, updates the pool and the temporary balances and adds it to the blockchain
+        """
+        with self.lock:
+            changes = self.apply_block(block)
+            self.update_temp_balances(block, changes)
+
+            # And add the block to the blockchain
+            self.blockchain.add_block(block)
+            if block.index % SNAPSHOT_INTERVAL == 0:
+                self.take_snapshot()
+
+    def apply_block(self, block:Block, announce=True):
+        """
+        Executes the transactions of a block and pays its fees to the validator (validated state only).
+        Returns the change of every balance the block changed ({id: change}).
+        """
+        with self.lock:
+            worked_out = self.work_out_block(block)
+            if worked_out is None:
+                raise ValueError(f"Block {block.index} names an unknown account")
+            balances, stakes = worked_out
+            changes = {}
+            for id, data in self.peers.items():
+                if balances[id] != data["balance"]:
+                    changes[id] = balances[id] - data["balance"]
+                data["balance"] = balances[id]
+                data["stake"] = stakes[id]
+            self.stakes_and_messages(block, announce)
+            return changes
+
+    def take_snapshot(self):
+        """
+        Saves the validated state of every account at the tip of the blockchain
+        """
+        with self.lock:
+            accounts = {
+                id: {"public_key": data["public_key"], "balance": data["balance"], "stake": data["stake"]}
+                for id, data in self.peers.items()
+            }
+            last_block = self.blockchain.chain[-1]
+            self.snapshots.save(Snapshot(len(self.blockchain.chain) - 1, last_block.current_hash, accounts))
+
+    def genesis_snapshot(self, blockchain:Blockchain):
+        """
+        Returns the state right after our genesis block (every node has its initial stake and the genesis
+        transactions are paid) as a snapshot - None if the blockchain starts from another genesis block
+        """
+        genesis = self.blockchain.chain[0]
+        if blockchain.chain[0].current_hash != genesis.current_hash:
+            return None
+        accounts = {
+            id: {"public_key": data["public_key"], "balance": 0, "stake": STAKE} for id, data in self.peers.items()
+        }
+        for transaction in genesis.transactions:
+            receiver_id = self.address_book.id_of(transaction.receiver_address)
+            if receiver_id is not None:
+                accounts[receiver_id]["balance"] += transaction.amount
+        return Snapshot(0, genesis.current_hash, accounts)
+
+    def restore_state(self):
+        """
+        Rebuilds the validated state for the blockchain from the newest snapshot taken on it, executing only
+        the blocks after that snapshot (all of them if there is none). Returns False if the blockchain does
+        not start from our genesis block.
+        """
+        with self.lock:
+            snapshot = self.snapshots.latest_matching(self.blockchain) or self.genesis_snapshot(self.blockchain)
+            if snapshot is None:
+                return False
+
+            for id, account in snapshot.accounts.items():
+                self.peers[id]["balance"] = account["balance"]
+                self.peers[id]["stake"] = account["stake"]
+            self.pos.set_stakes(snapshot.stakes())
+            for height in range(snapshot.height + 1, len(self.blockchain.chain)):
+                self.apply_block(self.blockchain.chain[height], announce=False)
+
+            self.rebuild_pool()
+            return True
+
+    def rebuild_pool(self):
+        """
+        Recomputes the temporary state from the validated one and puts the pending transactions that are still
+        valid back in the pool (their signatures were already verified)
+        """
+        with self.lock:
+            pending = list(self.transaction_pool.transactions.values())
+            self.transaction_pool.clear()
+            self.fix_temp_balances()
+            self.temp_stake = self.peers[self.id]["stake"]
+            for transaction in pending:
+                if not self.transaction_in_blockchain(transaction):
+                    self.handle_transaction(transaction, True, signature_valid=True)
+
+    def update_temp_balances(self, block:Block, changes):
+        """
+        Brings the temporary balances (validated balances + pool) up to date after executing a block,
+        without replaying the pool: the block's changes to the validated balances are added, and the
+        changes of its transactions that were already in the pool are taken out (they are now validated).
+        Only the senders of transactions we had not seen are checked again.
+        """
+        for id, change in changes.items():
+            self.temp_balance[id] += change
+
+        touched = set()
+        for transaction, effects in self.transaction_pool.remove_from_pool(block.transactions):
+            if effects is None:
+                touched.add(self.address_book.id_of(transaction.sender_address))
+                continue
+            for id, change in effects.items():
+                self.temp_balance[id] -= change
+        touched.discard(None)
+
+        self.revalidate_pool(touched)
+
+        # Our temporary stake is the one of our latest pending Stake transaction (or the validated one)
+        self.temp_stake = self.peers[self.id]["stake"]
+        for transaction in self.transaction_pool.pending_of(self.public_key):
+            if transaction.type == "Stake":
+                self.temp_stake = transaction.amount
+
+    def revalidate_pool(self, ids):
+        """
+        Drops the newest pending transactions of every account in ids until its temporary balance
+        is no longer negative. Receivers that lose money this way are checked as well.
+        """
+        to_check = list(ids)
+        while to_check:
+            id = to_check.pop()
+            address = self.address_book.public_key_of(id)
+            pending = self.transaction_pool.pending_of(address)
+            while self.temp_balance[id] < 0 and pending:
+                transaction = pending.pop()
+                effects = self.transaction_pool.discard(transaction)
+                print("Dropping transaction", transaction.transaction_id, "no longer covered")
+                for changed_id, change in effects.items():
+                    self.temp_balance[changed_id] -= change
+                    if change > 0 and self.temp_balance[changed_id] < 0:
+                        to_check.append(changed_id)
+
+    def covered_in_block(self):
+        """
+        Returns a check for picking the transactions of a new block in any order: it accepts a transaction
+        only if its sender can cover it with the validated balances plus the transactions accepted before it
+        """
+        balances = {id: data["balance"] for id, data in self.peers.items()}
+        stakes = {id: data["stake"] for id, data in self.peers.items()}
+
+        def covered(transaction:Transaction):
+            sender_id = self.address_book.id_of(transaction.sender_address)
+            if sender_id is None or balances[sender_id] < transaction.amount + transaction.fee:
+                return False
+            if transaction.type == "Stake":
+                balances[sender_id] -= transaction.amount - stakes[sender_id]
+                stakes[sender_id] = transaction.amount
+            else:
+                receiver_id = self.address_book.id_of(transaction.receiver_address)
+                if receiver_id is None:
+                    return False
+                balances[sender_id] -= transaction.amount + transaction.fee
+                balances[receiver_id] += transaction.amount
+            return True
+
+        return covered
 
     def fix_temp_balances(self):
         with self.lock:
             for id, data in self.peers.items():
                 self.temp_balance[id] = data["balance"]
 
-    def stakes_and_messages(self, block: Block):
+    def stakes_and_messages(self, block: Block, announce=True):
         with self.lock:
-            latest_stakes = {}  # Dictionary to store the latest stake transaction for each node
-
+            # The stakes (and the balances they lock) were already set when the block was worked out
             for transaction in block.transactions:
-                if transaction.type == "Stake":
-                    # Get the ID of the node making the stake transaction
-                    stake_node_id = None
-                    for id, dict_id in self.peers.items():
-                        if dict_id["public_key"] == transaction.sender_address:
-                            stake_node_id = id
-                            break
-                    # Update the latest stake transaction for the node
-                    if stake_node_id is not None:  # Make sure node ID is found
-                        latest_stakes[stake_node_id] = transaction.amount
-
-                if transaction.type == "Exchange" and self.public_key == transaction.receiver_address:
-                    sender_id = None
-                    for id, dict_id in self.peers.items():
-                        if dict_id["public_key"] == transaction.sender_address:
-                            sender_id = id
+                if announce and transaction.type == "Exchange" and self.public_key == transaction.receiver_address:
+                    sender_id = self.address_book.id_of(transaction.sender_address)
                     if transaction.message != "":
                         print("User with ID", sender_id, "messaged you:", transaction.message)
                     else:
                         print("User with ID", sender_id, "sent you", transaction.amount, "BCCs")
 
-            # Update balances after processing all transactions
-            for id, data in self.peers.items():
-                # Add the latest stake amount for nodes that have a stake transaction in the block
-                if id in latest_stakes:
-                    self.temp_balance[id] += data["stake"]
-                    self.temp_balance[id] -= latest_stakes[id]
-
-                    # Update the stake amount in the peers dictionary
-                    self.peers[id]["stake"] = latest_stakes[id]
-
             # Update the POS stakes after processing all transactions
             stakes_dict = {}
             for id, data in self.peers.items():
@@ -378,43 +551,51 @@ class Wallet:
             self.pos.set_stakes(stakes_dict)
 
     def broadcast_block(self, block:Block):
-        """ Broadcasts Block """
-        message = Message("BLOCK", block)
-        message = BlockChainUtils.encode(message)
-        with self.lock:
-            if message is not None:
-                message = pickle.dumps(message)
-                for socket in self.nodes.values():
-                    socket.sendall(message)
-
-    def broadcast_blockchain(self, blockchain:Blockchain):
-        """ Broadcasts Block """
-        message = Message("BLOCKCHAIN", blockchain)
-        message = BlockChainUtils.encode(message)
-
-        if message is not None:
-            message = pickle.dumps(message)
-            for socket in self.nodes.values():
-                socket.sendall(message)
+        """ Broadcasts Block (only its header and transaction ids with COMPACT_BLOCKS - the peers hold the rest) """
+        if COMPACT_BLOCKS:
+            self.broadcast(Message("COMPACT_BLOCK", compact_block(block)))
+        else:
+            self.broadcast(Message("BLOCK", block))
 
     def handle_blockchain(self, blockchain:Blockchain):
         """
         Checks if blockchain is valid - if valid it replaces your blockchain
         """
-        if self.validate_blockchain(blockchain):
-            self.blockchain = blockchain
-        else:
-            print("Invalid blockchain")
+        with self.lock:
+            if self.validate_blockchain(blockchain):
+                blockchain.rebuild_transaction_index()
+                if self.blockchain.store is not None:
+                    blockchain.persist(self.blockchain.store)
+                self.blockchain = blockchain
+                # Replace the account state too
+                self.restore_state()
+            else:
+                print("Invalid blockchain")
 
     def validate_blockchain(self, blockchain:Blockchain):
         """
-        Validates a blockchain
+        Validates a blockchain. The blocks up to our newest snapshot on it are trusted (checkpoint),
+        only the blocks after it are checked, with the stakes replayed from the snapshot. Without such a
+        snapshot every block after our genesis block is checked.
         """
-        for block in blockchain.chain:
-            if block.index == 0:
-                continue
-            if not self.validate_block(block):
+        checkpoint = self.snapshots.latest_matching(blockchain) or self.genesis_snapshot(blockchain)
+        if checkpoint is None:
+            return False  # It does not start from our genesis block
+        pos = ProofOfStake()
+        stakes = checkpoint.stakes()
+        for height in range(checkpoint.height + 1, len(blockchain.chain)):
+            block = blockchain.chain[height]
+            prev_hash = blockchain.chain[height - 1].current_hash
+            pos.set_stakes(stakes)
+            validator_pk = self.address_book.public_key_of(pos.validator(prev_hash))
+            if not self.check_block(block, prev_hash, validator_pk):
                 return False
+            stakes = dict(stakes)
+            for transaction in block.transactions:
+                if transaction.type == "Stake":
+                    stake_node_id = self.address_book.id_of(transaction.sender_address)
+                    if stake_node_id is not None:
+                        stakes[stake_node_id] = transaction.amount
         return True
 
 
@@ -429,9 +610,9 @@ class Wallet:
         for transaction in last_block_transactions:
             print(transaction.payload())
 
-        for last_validator_id, data in self.peers.items():
-            if data["public_key"] == last_validator_by_key:
-                print("With validator (by id): ", last_validator_id)
+        last_validator_id = self.address_book.id_of(last_validator_by_key)
+        if last_validator_id is not None:
+            print("With validator (by id): ", last_validator_id)
 
     def my_balance(self):
         """Returns the balance and safe-state stake of the node"""